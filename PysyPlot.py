@@ -1,48 +1,140 @@
 #! /usr/bin/env python3
 # coding: utf-8
 
-import operator as op
-import numpy as np
-import pandas as pd
+import os
+import logging
+import argparse
+import functools
 
-import plotly as pl
-import gui.dashgui as gui
-import plotly.express as px
-import plotly.io as pio
+from core import startup
 
-import dash
-import dash_core_components as dcc
-import dash_html_components as html
+# Modules only imported when a workbook is read or plotted
+DEFERRED_MODULES = ("pandas", "core.read_data.xlsx", "core.plotdef",
+                    "plotly.utils")
 
-import core.datamanagement as dm
-import core.plotdef as plotdef
-import gui.dashgui as gui
 
-from dash.dependencies import Input, Output, State, MATCH, ALL
-from dash.exceptions import PreventUpdate
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Interactive plotter")
+    parser.add_argument('--watch', metavar='DIR',
+                        help="folder in which new or changed .xlsx "
+                             "workbooks are loaded on the server side")
+    parser.add_argument('--float32', action='store_true',
+                        help="with --binary, send the figure floats in "
+                             "simple precision where precision allows")
+    parser.add_argument('--binary', action='store_true',
+                        help="send the figure arrays as base64 typed arrays "
+                             "(needs plotly.js 2.28 or above, i.e. "
+                             "dash-core-components 2.x)")
+    parser.add_argument('--payload-metrics', action='store_true',
+                        help="log the size and serialization time of each "
+                             "figure update")
+    parser.add_argument('--filter-metrics', action='store_true',
+                        help="log the plan and timings of each filtering "
+                             "of the rows by subsets")
+    parser.add_argument('--read-engine', choices=('stream', 'openpyxl'),
+                        default='openpyxl',
+                        help="engine parsing the workbooks : streaming "
+                             "parser of the sheets XML (falls back to "
+                             "openpyxl if it cannot read a workbook), or "
+                             "openpyxl (default)")
+    parser.add_argument('--read-workers', type=int, default=1,
+                        help="number of processes parsing the sheets of a "
+                             "workbook (default : 1)")
+    parser.add_argument('--dataset-timeout', type=float, default=60.,
+                        metavar='MINUTES',
+                        help="idle time after which a dataset is dropped "
+                             "from memory (default : 60 minutes)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of server processes (Unix only), "
+                             "sharing the parsed workbooks through "
+                             "memory-mapped files")
+    parser.add_argument('--jobs', type=int, default=2,
+                        help="number of background threads per server "
+                             "process for the uploads and plots "
+                             "(default : 2)")
+    parser.add_argument('--port', type=int, default=8080,
+                        help="listening port (default : 8080)")
+    parser.add_argument('--import-time', action='store_true',
+                        help="print the slowest imports of the startup "
+                             "(as python -X importtime)")
+    return parser.parse_args(argv)
 
-#def main():
 
-#if __name__ == "__main__":
-#    main()
+def main(argv=None):
+    args = parse_args(argv)
+    if args.import_time:
+        timer = startup.ImportTimer()
+        timer.install()
 
-datam = dm.DataManager()
+    import core.datamanagement as dm
+    import core.datasets as datasets
+    import core.figurecache as figurecache
+    import core.jobs as jobs
+    import core.watch as watch
+    import core.broadcast as broadcast
+    import gui.dashgui as gui
+    import gui.serving as serving
 
-#datam.readxlsx("data/test3.xlsx")
+    # One data manager per dataset, shared by the pages (which keep
+    # their own subsets). Parsed workbooks are cached on disk, keyed by
+    # their content, and shared in memory; the figures are shared too
+    cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "PysyPlot")
+    new_datam = functools.partial(
+        dm.DataManager,
+        cache_dir=cache_dir,
+        read_workers=args.read_workers,
+        read_engine=args.read_engine,
+        filter_metrics=args.filter_metrics,
+        shared=datasets.SharedDatasets(),
+        figure_cache=figurecache.FigureCache())
 
-pio.renderers.default='browser'
-# plot1 = plotdef.ParCoorPlot(dataframe=datam.dataframe,
-#                             subsets=datam.subsets)
+    store = datasets.DatasetStore(new_datam, 60 * args.dataset_timeout)
 
-# plot2 = plotdef.ScatterPlot(dataframe=datam.dataframe,
-#                             subsets=datam.subsets,
-#                             x_var=('regime',"rpm"),
-#                             y_var=('poussee',"N"),
-#                             z_var=None)
+    # Uploads and plots run in the background, their status and results
+    # written in the cache folder (polled by any worker)
+    job_queue = jobs.JobQueue(os.path.join(cache_dir, ".jobs"),
+                              workers=args.jobs)
 
-app = gui.set_app_layout(datam)
-gui.callbacks(app, datam)
-# app.layout.children.append(dcc.Graph(id='plot1', figure=plot1.figure))
-# app.layout.children.append(dcc.Graph(id='plot2', figure=plot2.figure))
-app.run_server(debug=False, port=8080, host='0.0.0.0')
+    # With several workers, the watched datasets are broadcast through a
+    # file of the cache folder
+    if args.workers > 1:
+        watch_sequence = broadcast.SequenceFile(os.path.join(cache_dir,
+                                                             ".watch.seq"))
+        watch_sequence.remove() # publications of a previous run
+    else:
+        watch_sequence = None
 
+    # Optional server-side ingestion of the workbooks of a folder (in the
+    # parent process with several workers, broadcast to the workers)
+    if args.watch is None:
+        watcher = None
+        watcher_task = None
+    else:
+        folder_watcher = watch.FolderWatcher(new_datam(), args.watch,
+                                             sequence=watch_sequence)
+        watcher_task = folder_watcher.start
+        if watch_sequence is None:
+            watcher = folder_watcher
+        else:
+            watcher = broadcast.WatchBroadcast(args.watch, watch_sequence,
+                                               new_datam())
+
+    app = gui.set_app_layout(watcher)
+    if args.payload_metrics or args.filter_metrics:
+        logging.basicConfig(level=logging.INFO)
+    gui.callbacks(app, store, job_queue, watcher, binary=args.binary,
+                  float32=args.float32, metrics=args.payload_metrics)
+
+    # The forked workers share the modules imported before : the
+    # deferred ones are imported once in the parent
+    if args.workers > 1:
+        startup.preload(DEFERRED_MODULES)
+    if args.import_time:
+        timer.uninstall()
+        print(timer.report())
+    serving.run(app, host='0.0.0.0', port=args.port, workers=args.workers,
+                parent_task=watcher_task)
+
+
+if __name__ == "__main__":
+    main()
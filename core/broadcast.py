@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import os
+import pickle
+import tempfile
+
+try:
+    import fcntl
+except ImportError: # not available on Windows : single process only
+    fcntl = None
+
+
+class SequenceFile:
+    """Record shared between the processes of a server through a file.
+
+    Each publication increments a sequence number (under a lock file,
+    so that concurrent publishers get distinct numbers) and replaces
+    the file at once. Readers only reload the file when it changed on
+    disk : polling it costs a "stat".
+    """
+
+    def __init__(self, path):
+        """Sequence file at "path" (created on first publication). """
+        self.path = path
+        self._stamp = None
+        self._value = (0, None)
+
+    def read(self):
+        """Tupple (sequence number, record) of the last publication,
+        (0, None) if nothing was published. """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return (0, None)
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp != self._stamp:
+            try:
+                with open(self.path, 'rb') as file:
+                    self._value = pickle.load(file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                return self._value
+            self._stamp = stamp
+        return self._value
+
+    def publish(self, record):
+        """Publish a picklable record. Return its sequence number. """
+        with open(self.path + ".lock", 'wb') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            (sequence, previous) = self.read()
+            sequence += 1
+            (fd, tmp_path) = tempfile.mkstemp(
+                dir=os.path.dirname(self.path) or ".", prefix=".tmp")
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump((sequence, record), file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        return sequence
+
+    def remove(self):
+        for path in (self.path, self.path + ".lock"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class WatchBroadcast:
+    """Folder watcher running in another process (see FolderWatcher),
+    seen through its sequence file : same "directory", "status" and
+    "dm" as the watcher for the GUI, the published dataset being
+    attached from the workbook cache (memory-mapped, not copied).
+
+    Attributes
+    ----------
+    directory : string
+        Watched folder.
+    """
+
+    def __init__(self, directory, sequence, dm):
+        """Parameters
+        ----------
+        directory : string
+            Folder watched by the other process.
+        sequence : SequenceFile
+            Sequence file in which the watcher publishes its datasets.
+        dm : DataManager
+            Data manager in which the published datasets are attached.
+        """
+        self.directory = directory
+        self._sequence = sequence
+        self._dm = dm
+
+    @property
+    def status(self):
+        """Tupple (version, file name, last modification timestamp,
+        error message), as FolderWatcher.status. """
+        (sequence, record) = self._sequence.read()
+        if record is None:
+            return (0, None, None, None)
+        return (sequence, record['name'], record['mtime'], record['error'])
+
+    @property
+    def dm(self):
+        """Data manager with the last published dataset. """
+        (sequence, record) = self._sequence.read()
+        if record is not None and record['key'] is not None:
+            self._dm.attach(record['key'])
+        return self._dm
+
+
+def main():
+    import time
+    directory = tempfile.mkdtemp()
+    writer = SequenceFile(os.path.join(directory, "watch.seq"))
+    reader = SequenceFile(writer.path)
+    print("Before publication :", reader.read())
+    writer.publish({'name': "a.xlsx"})
+    writer.publish({'name': "b.xlsx"})
+    print("After publications :", reader.read())
+    start = time.perf_counter()
+    for i in range(1000):
+        reader.read()
+    print("Poll : {0:.1f} us".format(1000 * (time.perf_counter() - start)))
+    writer.remove()
+    os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
 #! /usr/bin/env python3
 # coding: utf-8
 
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import operator as op
-import numpy as np
-import pandas as pd
 
-from .read_data import xlsx as xl
-from . import plotdef as pl
+from .read_data.cache import WorkbookCache
+from .masking import MaskEngine
+from .figurecache import FigureCache
+from .datasets import SharedDataset
+
+# pandas and the reading (openpyxl) and plotting (plotly) modules are
+# imported on first use : they are not needed to start the server
+
+logger = logging.getLogger(__name__)
 
 
 class DataManager:
@@ -14,15 +23,53 @@ class DataManager:
     
     Class designed to simplify interfaces between the
     core logic and dash gui.
+    One data manager per dataset, shared by the browser sessions (see
+    DatasetStore) : the subsets are defined by the pages and passed
+    with each plot. Its methods are serialized by a lock. With a
+    "shared" registry of datasets (SharedDatasets), identical workbooks
+    share the same read-only dataframe; a "figure_cache" can also be
+    shared (figures are keyed by the content of the dataset). Batches
+    of figures are built by "plot_workers" threads (see "plot_batch").
+    With "filter_metrics", the plan and timings of each filtering by
+    subsets are logged (see "filter_report").
 
     Attributes
     ----------
  
     """
     
-    def __init__(self, **kwargs):
+    def __init__(self, *, read_workers=1, read_engine='openpyxl',
+                 cache_dir=None, cache_size=2**30, max_series=50,
+                 max_points=20000, max_parcoor_rows=10000,
+                 max_parcoor_dims=12, figure_cache_size=2**28,
+                 figure_cache=None, shared=None, plot_workers=4,
+                 filter_metrics=False, **kwargs):
+        self._lock = threading.RLock()
+        self._shared = shared
+        self._dataset = None
+        self._read_workers = read_workers
+        self._read_engine = read_engine
+        if cache_dir is None:
+            self._cache = None
+        else:
+            self._cache = WorkbookCache(cache_dir, cache_size)
+        self._max_series = max_series
+        self._max_points = max_points
+        self._max_parcoor_rows = max_parcoor_rows
+        self._max_parcoor_dims = max_parcoor_dims
+        self._plot_workers = plot_workers
+        self._filter_metrics = filter_metrics
+        if figure_cache is None:
+            self._figures = FigureCache(figure_cache_size)
+        else:
+            self._figures = figure_cache
         self._dataframe = None
-        self._subsets = {}
+        self._version = 0
+        self._content_key = None
+        self._masks = MaskEngine()
+        self._encodings = {}
+        self._comments = {}
+        self._sheets = []
         self._df_vars = []
         self._df_ops = [{'disp':'==', 'op':op.eq},
                         {'disp':'!=', 'op':op.ne},
@@ -37,16 +84,32 @@ class DataManager:
         return self._dataframe
 
     @property
-    def subsets(self):
-        """Dict of tupples (str var, operator, value) identified by an
-        integer ID.
-        used for data slicing :
-            - str var : dataframe column ID tupple (var, unit) expected.
-            - fct operator : to apply (using operator basic package)
-            - float value : criterion for the filter.
-        """
-        return self._subsets
-    
+    def version(self):
+        """Dataset version, incremented each time data is loaded. """
+        return self._version
+
+    @property
+    def content_key(self):
+        """Key of the content of the dataset (hash of the workbook),
+        None if nothing is loaded. """
+        return self._content_key
+
+    @property
+    def filter_report(self):
+        """Plan and timings of the last filtering by subsets (str). """
+        return self._masks.plan_report()
+
+    @property
+    def figure_cache_stats(self):
+        """Dict of the figure cache counters (hits, misses, figures,
+        size in bytes). """
+        return self._figures.stats()
+
+    @property
+    def comments(self):
+        """Dict of the comments (str) of each sheet, by sheet name. """
+        return self._comments
+
     @property
     def df_vars(self):
         """List of dicts :
@@ -61,52 +124,391 @@ class DataManager:
             - operator. """
         return self._df_ops
 
-    def add_subset(self, subset_id, subset):
-        """Add a subset to the list. """
-        self._subsets[subset_id] = subset
-        
-    def remove_subset(self, subset_id):
-        """Remove a subset from the list. """
-        del self._subsets[subset_id]
-        
-    def readxlsx(self, container):
-        """Concert an Excel workbook to a Dataframe. """
-        self._dataframe = xl.workbook_to_dataframe(container)
-        self._df_vars = {var[0] + ' (' + var [1] + ")": var
-                         for var in self._dataframe.columns}
+    def readxlsx(self, container, progress=None):
+        """Concert an Excel workbook to a Dataframe.
+        Sheets are parsed by "read_workers" processes, with the
+        "read_engine" engine ("openpyxl" or "stream"); "progress" is
+        called with the number of sheets parsed and to parse.
+        A workbook already in memory (shared registry) is not parsed
+        again; if a cache folder is defined, a workbook already parsed
+        is read back from the cache instead. A parsed workbook is then
+        used from the cache too : its columns are memory-mapped, shared
+        with the other processes of the server. """
+        from .read_data import xlsx as xl
+        content = xl.file_content(container)
+        key = WorkbookCache.key(content)
+        with self._lock:
+            dataset = self._known_dataset(key)
+            if dataset is None:
+                dataset = self._read_workbook(io.BytesIO(content), progress)
+                if self._cache is not None:
+                    self._cache.put(key, dataset.dataframe,
+                                    {'comments': dataset.comments,
+                                     'df_vars': dataset.df_vars,
+                                     'sheets': dataset.sheets})
+                    dataset = self._known_dataset(key) or dataset
+            if self._shared is not None:
+                dataset = self._shared.put(key, dataset)
+            self._set_dataset(dataset, key)
+
+    def _known_dataset(self, key):
+        """Dataset of a content key already parsed : from the shared
+        registry, or from the cache. None if unknown. """
+        dataset = None
+        if self._shared is not None:
+            dataset = self._shared.get(key)
+        if dataset is None and self._cache is not None:
+            cached = self._cache.get(key)
+            if cached is not None:
+                (dataframe, infos) = cached
+                dataset = SharedDataset(dataframe, infos['comments'],
+                                        infos['df_vars'], infos['sheets'])
+        return dataset
+
+    def attach(self, key):
+        """Use the dataset of a content key parsed by this or another
+        process (see "readxlsx"). Return False if it is not available
+        anymore. """
+        with self._lock:
+            if key == self._content_key:
+                return True
+            dataset = self._known_dataset(key)
+            if dataset is None:
+                return False
+            if self._shared is not None:
+                dataset = self._shared.put(key, dataset)
+            self._set_dataset(dataset, key)
+            return True
+
+    def _set_dataset(self, dataset, content_key):
+        """Define the dataset (SharedDataset, read-only). """
+        self._dataset = dataset
+        self._dataframe = dataset.dataframe
+        self._comments = dataset.comments
+        self._df_vars = dataset.df_vars
+        self._sheets = dataset.sheets
+        self._new_version(content_key)
+
+    def _new_version(self, content_key=None):
+        """Increment the dataset version after a data change.
+        "content_key" identifies the content of the dataset (hash of
+        the workbook) for the figure cache. """
+        self._version += 1
+        self._content_key = content_key
+        self._masks.set_dataframe(self._dataframe, self._version)
+        self._encodings = {}
+
+    def _read_workbook(self, container, progress=None):
+        """Parse a workbook (dataset with the variables list).
+        Sheets already loaded with the same content (same fingerprint)
+        are taken back from the current dataframe : only new or changed
+        sheets are parsed. """
+        import pandas as pd
+        from .read_data import xlsx as xl
+        fingerprints = xl.sheet_fingerprints(container)
+        known_sheets = self._known_sheets()
+        if fingerprints is None:
+            new_indexes = None
+        else:
+            new_indexes = [i for (i, (title, fp)) in enumerate(fingerprints)
+                           if fp not in known_sheets]
+        parsed = xl.read_sheets(container, new_indexes,
+                                self._read_workers, self._read_engine,
+                                progress)
+        if fingerprints is None:
+            fingerprints = [(title, None) for (title, df, c) in parsed]
+            new_indexes = range(len(parsed))
+        parsed = dict(zip(new_indexes, parsed))
+
+        # Sheets dataframes spliced in the workbook order
+        sheet_dataframes = []
+        comments = {}
+        sheets = []
+        start = 0
+        for (sheet_i, (title, fp)) in enumerate(fingerprints):
+            if sheet_i in parsed:
+                (title, df, ws_comments) = parsed[sheet_i]
+            else:
+                df = self._sheet_dataframe(known_sheets[fp])
+                ws_comments = self._comments[title]
+            sheet_dataframes.append(df)
+            comments[title] = ws_comments
+            sheets.append({'title': title,
+                           'fingerprint': fp,
+                           'start': start,
+                           'stop': start + len(df),
+                           'dtypes': df.dtypes})
+            start += len(df)
+
+        dataframe = pd.concat(sheet_dataframes)
+        df_vars = {var[0] + ' (' + var [1] + ")": var
+                   for var in dataframe.columns}
+        return SharedDataset(dataframe, comments, df_vars, sheets)
+
+    def _known_sheets(self):
+        """Dict of the sheets of the current dataframe which can be
+        reused, by fingerprint. """
+        if self._dataframe is None or not self._dataframe.columns.is_unique:
+            return {}
+        return {sheet['fingerprint']: sheet for sheet in self._sheets
+                if sheet['fingerprint'] is not None}
+
+    def _sheet_dataframe(self, sheet):
+        """Rebuild the dataframe of a sheet from the current dataframe :
+        rows of the sheet, its own columns and their original types. """
+        rows = self._dataframe.iloc[sheet['start']:sheet['stop']]
+        cols_i = self._dataframe.columns.get_indexer(sheet['dtypes'].index)
+        return rows.iloc[:, cols_i].astype(dict(sheet['dtypes']))
         
     def check_subset(self, var, oper, crit):
         """Chech if an operation is applicable to the dataframe. """
-        # Check if not already existing
-        if (var, oper, crit) in [(ss['var'],
-                                  ss['oper'],
-                                  ss['crit'])for ss in self._subsets.values()]:
-            return False
-        # Check if criterion valid
-        try:
-            if crit.isnumeric() :
-                converted_crit = float(crit)
-            else:
-                converted_crit = crit
-            oper(self._dataframe[var], converted_crit)
-            return True
-        except Exception as e: 
-            print(e)
-            return False
+        with self._lock:
+            # Check if criterion valid (the rows are kept for the plots)
+            try:
+                self._combined_positions([(var, oper, crit)])
+                return True
+            except Exception as e: 
+                print(e)
+                return False
         
-    def plot_par_coor(self, subsets, varlist):
-        plotter = pl.ParCoorPlot(dataframe = self._dataframe,
-                                 subsets = subsets,
-                                 varlist = varlist)
-        return plotter.figure
+    def _combined_positions(self, subsets):
+        """Sorted positions of the rows respecting all the subsets (see
+        MaskEngine.combined_positions). The plan is logged with
+        "filter_metrics". """
+        positions = self._masks.combined_positions(subsets)
+        if self._filter_metrics and len(subsets) > 0:
+            logger.info("Filtering plan :\n%s", self.filter_report)
+        return positions
+
+    def _encoding(self, var):
+        """Codes and values of a column (pandas.factorize, values in
+        order of first appearance), cached for the dataset version. """
+        try:
+            return self._encodings[var]
+        except KeyError:
+            pass
+        import pandas as pd
+        column = self._dataframe[var]
+        if column.ndim == 2: # duplicated column name
+            column = column.squeeze(axis=1)
+        encoding = pd.factorize(column.to_numpy(), use_na_sentinel=False)
+        self._encodings[var] = encoding
+        return encoding
+
+    def _figure_key(self, plot_type, subsets, *spec):
+        """Key of a figure in the cache : dataset content (or version),
+        plot type, subsets (order and duplicates ignored) and plot
+        parameters. """
+        if self._content_key is None:
+            dataset = ('version', self._version)
+        else:
+            dataset = self._content_key
+        subsets = tuple(sorted({(var, oper.__name__, crit)
+                                for (var, oper, crit) in subsets}, key=repr))
+        spec = tuple(tuple(p) if isinstance(p, list) else p for p in spec)
+        return (dataset, plot_type, subsets) + spec
+
+    # Parameters of the plots (name, default value), in the order of
+    # the figure keys
+    _PLOT_PARAMS = {'scatter': (('x_var', None), ('y_var', None),
+                                ('z_var', None), ('render', 'auto'),
+                                ('x_range', None), ('y_range', None)),
+                    'parcoor': (('varlist', None), ('pinned', None))}
+
+    def _plotter(self, plot_type, params, **source):
+        """Plotter of a plot type ("scatter" or "parcoor") with its
+        parameters (see "_PLOT_PARAMS"), on a source of rows (dataframe,
+        subsets, masker and encoder). """
+        from . import plotdef as pl
+        params = {name: params.get(name, default)
+                  for (name, default) in self._PLOT_PARAMS[plot_type]}
+        if plot_type == 'scatter':
+            return pl.ScatterPlot(dataframe = source['dataframe'],
+                                  subsets = source['subsets'],
+                                  masker = source['masker'],
+                                  max_series = self._max_series,
+                                  max_points = self._max_points,
+                                  **params)
+        return pl.ParCoorPlot(dataframe = source['dataframe'],
+                              subsets = source['subsets'],
+                              masker = source['masker'],
+                              encoder = source['encoder'],
+                              max_rows = self._max_parcoor_rows,
+                              max_dims = self._max_parcoor_dims,
+                              **params)
+
+    def _filter_rows(self, subsets, progress):
+        """Resolve the subsets of a plot (see "_combined_positions"),
+        reporting the steps to "progress" (steps done, total steps,
+        description). """
+        if progress is not None:
+            progress(0, 2, "filtering rows")
+        positions = self._combined_positions(subsets)
+        if progress is not None:
+            n_rows = (self._masks.n_rows if positions is None
+                      else len(positions))
+            progress(1, 2, "plotting {0} rows".format(n_rows))
+        return positions
+
+    def plot_par_coor(self, subsets, varlist, pinned=None, progress=None):
+        """Parallel coordinates figure, with at most "max_parcoor_rows"
+        rows (sampled by sheet) and, if "varlist" is None, at most
+        "max_parcoor_dims" axes (the "pinned" variables, then the
+        variables of highest variance). "progress" is called with the
+        steps done, the total steps and their description. """
+        with self._lock:
+            key = self._figure_key('parcoor', subsets, varlist, pinned)
+            figure = self._figures.get(key)
+            if figure is not None:
+                return figure
+            positions = self._filter_rows(subsets, progress)
+            plotter = self._plotter('parcoor',
+                                    {'varlist': varlist, 'pinned': pinned},
+                                    dataframe = self._dataframe,
+                                    subsets = subsets,
+                                    masker = lambda subsets: positions,
+                                    encoder = self._encoding)
+            self._figures.put(key, plotter.figure)
+            return plotter.figure
     
-    def plot_scatter(self, subsets, x_var, y_var, z_var):
-        plotter = pl.ScatterPlot(dataframe = self._dataframe,
-                                 subsets = subsets,
-                                 x_var = x_var,
-                                 y_var = y_var,
-                                 z_var = z_var)
-        return plotter.figure
+    def plot_scatter(self, subsets, x_var, y_var, z_var, render='auto',
+                     x_range=None, y_range=None, progress=None):
+        """Scatter plot figure. The rendering ("svg", "webgl" or server
+        side "density") is chosen from the number of points if "render"
+        is "auto". Above "max_points" points, the series are decimated;
+        "x_range" and "y_range" restrict the plot to a zoomed window
+        (decimated again from the filtered rows). "progress" as in
+        "plot_par_coor". """
+        with self._lock:
+            key = self._figure_key('scatter', subsets, x_var, y_var, z_var,
+                                   render, x_range, y_range)
+            figure = self._figures.get(key)
+            if figure is not None:
+                return figure
+            positions = self._filter_rows(subsets, progress)
+            plotter = self._plotter('scatter',
+                                    {'x_var': x_var, 'y_var': y_var,
+                                     'z_var': z_var, 'render': render,
+                                     'x_range': x_range,
+                                     'y_range': y_range},
+                                    dataframe = self._dataframe,
+                                    subsets = subsets,
+                                    masker = lambda subsets: positions,
+                                    encoder = self._encoding)
+            self._figures.put(key, plotter.figure)
+            return plotter.figure
+
+    def plot_batch(self, plots, progress=None):
+        """Figures of several plots, built in one pass.
+
+        "plots" is a list of tupples (plot type "scatter" or "parcoor",
+        subsets, dict of the parameters of "plot_scatter" or
+        "plot_par_coor"); a tupple (figure, error message) is returned
+        for each plot, in the same order.
+        Identical plots are built once, and figures already known are
+        taken from the cache. Each combination of subsets is resolved
+        once, and the columns needed by its plots are sliced once (a
+        parallel coordinates plot choosing its variables sees the whole
+        dataframe). The figures are then built by "plot_workers" threads
+        (NumPy releases the GIL on the heavy work). "progress" is called
+        with the figures built, the figures to build and a description.
+        A figure which cannot be built is None with the message of its
+        error (None for the figures built), the other figures of the
+        batch are still built.
+        """
+        with self._lock:
+            # Each key looked up once in the cache (hits and misses
+            # counted once)
+            keys = []
+            figures = {}
+            errors = {}
+            to_build = {}
+            for (plot_type, subsets, params) in plots:
+                key = self._figure_key(plot_type, subsets,
+                                       *(params.get(name, default)
+                                         for (name, default)
+                                         in self._PLOT_PARAMS[plot_type]))
+                keys.append(key)
+                if key in figures or key in to_build:
+                    continue
+                figure = self._figures.get(key)
+                if figure is None:
+                    to_build[key] = (plot_type, subsets, params)
+                else:
+                    figures[key] = figure
+
+            # Rows and columns of each combination of subsets
+            groups = {}
+            for (key, (plot_type, subsets, params)) in to_build.items():
+                groups.setdefault(frozenset(subsets), []).append(key)
+            sources = {}
+            for (group_i, (subsets, group_keys)) in enumerate(groups.items()):
+                if progress is not None:
+                    progress(group_i, len(groups), "filtering rows")
+                sources.update(self._batch_sources(
+                    subsets, {key: to_build[key] for key in group_keys}))
+
+            # Figures built by the threads
+            if to_build:
+                workers = max(1, min(self._plot_workers, len(to_build)))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(self._build_figure, key,
+                                               to_build[key], sources[key]):
+                               key for key in to_build}
+                    try:
+                        for (built, future) in enumerate(
+                                as_completed(futures), 1):
+                            try:
+                                figures[futures[future]] = future.result()
+                            except Exception as e:
+                                figures[futures[future]] = None
+                                errors[futures[future]] = str(e)
+                            if progress is not None:
+                                progress(built, len(to_build),
+                                         "figures built")
+                    except BaseException:
+                        for future in futures:
+                            future.cancel()
+                        raise
+            return [(figures[key], errors.get(key)) for key in keys]
+
+    def _batch_sources(self, subsets, plots):
+        """Source of the rows (see "_plotter") of each plot of a batch
+        sharing the same subsets, by figure key : the filtered rows of
+        the columns of the plots, sliced once. """
+        subsets = list(subsets)
+        positions = self._combined_positions(subsets)
+        if positions is None:
+            whole = {'dataframe': self._dataframe, 'subsets': [],
+                     'masker': None, 'encoder': self._encoding}
+            return {key: whole for key in plots}
+        variables = []
+        for (plot_type, _, params) in plots.values():
+            if plot_type == 'scatter':
+                variables.extend(params.get(v) for v in ('x_var', 'y_var',
+                                                         'z_var'))
+            elif params.get('varlist') is not None:
+                variables.extend(params['varlist'])
+        variables = [v for v in dict.fromkeys(variables) if v is not None]
+        cols_i = self._dataframe.columns.get_indexer_for(variables)
+        sliced = {'dataframe': self._dataframe.iloc[positions, cols_i],
+                  'subsets': [], 'masker': None, 'encoder': None}
+        # Variables chosen among all the columns : whole dataframe, with
+        # the rows already resolved
+        filtered = {'dataframe': self._dataframe, 'subsets': subsets,
+                    'masker': lambda subsets: positions,
+                    'encoder': self._encoding}
+        return {key: filtered if (plot_type == 'parcoor' and
+                                  params.get('varlist') is None) else sliced
+                for (key, (plot_type, _, params)) in plots.items()}
+
+    def _build_figure(self, key, plot, source):
+        """Figure of a plot of a batch, stored in the cache (by the
+        thread, with its size estimate). """
+        (plot_type, subsets, params) = plot
+        figure = self._plotter(plot_type, params, **source).figure
+        self._figures.put(key, figure)
+        return figure
 
 
 def main():
@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import time
+import weakref
+import threading
+
+
+class SharedDataset:
+    """Dataset loaded from a workbook, shared by the data managers
+    which loaded the same content. Read-only : a new workbook gives a new
+    dataset, the dataframe is never modified in place.
+
+    Attributes
+    ----------
+    dataframe : pandas dataframe
+        Data of all the sheets.
+    comments : dict
+        Comments (str) of each sheet, by sheet name.
+    df_vars : dict
+        Variables (var, unit) by description.
+    sheets : list of dicts
+        Position, fingerprint and types of each sheet.
+    """
+
+    def __init__(self, dataframe, comments, df_vars, sheets):
+        self.dataframe = dataframe
+        self.comments = comments
+        self.df_vars = df_vars
+        self.sheets = sheets
+
+
+class SharedDatasets:
+    """Registry of the datasets in memory, by content key (hash of the
+    workbook). A dataset is kept as long as a data manager uses it
+    (weak references) : identical workbooks loaded by several data
+    managers (e.g. the folder watcher and a browser upload) are parsed
+    once and share the same dataframe.
+    """
+
+    def __init__(self):
+        self._datasets = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._datasets)
+
+    def get(self, key):
+        """Dataset of a content key, or None if not in memory. """
+        with self._lock:
+            return self._datasets.get(key)
+
+    def put(self, key, dataset):
+        """Register a dataset and return the one to use : the dataset
+        already registered if another data manager loaded the same content
+        in the meantime, "dataset" otherwise. """
+        with self._lock:
+            known = self._datasets.get(key)
+            if known is not None:
+                return known
+            self._datasets[key] = dataset
+            return dataset
+
+
+class DatasetStore:
+    """Data managers of the datasets loaded on the server, by content
+    key (hash of the workbook).
+
+    The server keeps no state of the browser sessions : each page holds
+    the content key of its dataset, its subsets and its plot specs, and
+    sends them with each request. The data manager of a dataset (with
+    its masks, indexes and figures caches) is shared by all the pages
+    using it, and found again by any process of the server from the
+    workbook cache (see DataManager.attach). Data managers idle for
+    more than "idle_timeout" seconds are evicted.
+
+    Attributes
+    ----------
+    idle_timeout : float
+        Time without request after which a data manager is evicted, in
+        seconds.
+    """
+
+    def __init__(self, factory, idle_timeout=3600.):
+        """Creation of an empty store.
+
+        Parameters
+        ----------
+        factory : callable
+            Function without argument returning a new data manager.
+        idle_timeout : float
+            Eviction delay of the idle data managers, in seconds. The
+            default is one hour.
+        """
+        self._factory = factory
+        self.idle_timeout = idle_timeout
+        self._managers = {} # content key : [data manager, last access]
+        self._lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._managers)
+
+    def get(self, key):
+        """Data manager of a content key, or None if the dataset is not
+        available anymore (evicted from the workbook cache). """
+        if key is None:
+            return None
+        with self._lock:
+            self._evict_if_due()
+            manager = self._managers.get(key)
+            if manager is not None:
+                manager[1] = time.monotonic()
+                return manager[0]
+        dm = self._factory()
+        if not dm.attach(key):
+            return None
+        return self._register(dm)
+
+    def load(self, container, previous_key=None, progress=None):
+        """Data manager of a workbook (see DataManager.readxlsx).
+        Sheets unchanged since the dataset of "previous_key" are not
+        parsed again. """
+        dm = self._factory()
+        if previous_key is not None:
+            dm.attach(previous_key)
+        dm.readxlsx(container, progress)
+        return self._register(dm)
+
+    def _register(self, dm):
+        """Add a data manager, unless another request loaded the same
+        dataset in the meantime : the data manager to use. """
+        with self._lock:
+            manager = self._managers.setdefault(dm.content_key,
+                                                [dm, None])
+            manager[1] = time.monotonic()
+            return manager[0]
+
+    def evict_idle(self):
+        """Remove the data managers idle for more than "idle_timeout".
+        Return the number of data managers removed. """
+        with self._lock:
+            return self._evict(time.monotonic())
+
+    def _evict_if_due(self):
+        # Idle data managers checked at most once per minute
+        now = time.monotonic()
+        if now - self._last_eviction > min(60., self.idle_timeout):
+            self._evict(now)
+
+    def _evict(self, now):
+        idle = [key for (key, (dm, last_access)) in self._managers.items()
+                if now - last_access > self.idle_timeout]
+        for key in idle:
+            del self._managers[key]
+        self._last_eviction = now
+        return len(idle)
+
+
+def main():
+    import os
+    import tempfile
+    from .datamanagement import DataManager
+    filepath = os.path.join(os.path.dirname(__file__),
+                            "..", "data", "test3.xlsx")
+    cache_dir = tempfile.mkdtemp()
+    store = DatasetStore(lambda: DataManager(cache_dir=cache_dir),
+                         idle_timeout=0.1)
+    first = store.load(filepath)
+    second = store.load(filepath)
+    print("Same data manager :", first is second)
+    time.sleep(0.2)
+    print("Data managers evicted :", store.evict_idle())
+    # Found again from the workbook cache (e.g. by another process)
+    attached = store.get(first.content_key)
+    print("Same data :", attached.dataframe.equals(first.dataframe))
+
+
+if __name__ == "__main__":
+    main()
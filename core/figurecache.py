@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import collections
+import threading
+import numpy as np
+
+
+def figure_size(figure):
+    """Estimated memory size of a Plotly figure, in bytes (arrays by
+    their size, other values by a rough estimate). """
+    size = 0
+    stack = [figure.to_plotly_json()]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, np.ndarray):
+            size += obj.nbytes if obj.dtype != object else 8 * obj.size
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+            size += 64
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+            size += 8 * len(obj)
+        elif isinstance(obj, str):
+            size += len(obj)
+        else:
+            size += 8
+    return size
+
+
+class FigureCache:
+    """Least recently used cache of figures.
+
+    Figures are stored by key (any hashable value) and evicted in least
+    recently used order when their total estimated size exceeds
+    "max_size". The numbers of hits and misses are counted.
+
+    Attributes
+    ----------
+    max_size : int
+        Maximum size of the cached figures, in bytes.
+    hits : int
+        Number of figures found in the cache.
+    misses : int
+        Number of figures not found in the cache.
+    """
+
+    def __init__(self, max_size=2**28):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._figures = collections.OrderedDict() # key : (figure, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """Estimated size of the cached figures, in bytes. """
+        return self._size
+
+    def __len__(self):
+        return len(self._figures)
+
+    def get(self, key):
+        """Figure stored for a key, or None. """
+        with self._lock:
+            try:
+                (figure, size) = self._figures[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._figures.move_to_end(key)
+            self.hits += 1
+            return figure
+
+    def put(self, key, figure):
+        """Store a figure, then evict the least recently used figures
+        if the cache is too large (a figure larger than the cache is
+        not stored). """
+        size = figure_size(figure)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._figures:
+                self._size -= self._figures.pop(key)[1]
+            self._figures[key] = (figure, size)
+            self._size += size
+            while self._size > self.max_size:
+                (old_figure, old_size) = self._figures.popitem(last=False)[1]
+                self._size -= old_size
+
+    def clear(self):
+        """Remove all the figures (counters kept). """
+        with self._lock:
+            self._figures.clear()
+            self._size = 0
+
+    def stats(self):
+        """Dict of the cache counters : hits, misses, number of figures
+        and size. """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'figures': len(self._figures),
+                    'size': self._size}
@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import numbers
+import operator as op
+import numpy as np
+
+
+class SortedIndex:
+    """Index of a numeric column, for range and equality filters.
+
+    The row positions are sorted by value once (argsort), then each
+    filter is resolved by binary search (searchsorted) on the sorted
+    values. NaN values are sorted last and never match, as in
+    the comparison operators.
+    """
+
+    def __init__(self, values):
+        """Build the index of an array of numbers. """
+        values = np.asarray(values)
+        self._order = np.argsort(values, kind='stable')
+        self._sorted = values[self._order]
+        self._n_rows = len(values)
+        if values.dtype.kind == 'f':
+            self._n_valid = self._n_rows - int(np.isnan(values).sum())
+        else:
+            self._n_valid = self._n_rows
+
+    def _slice(self, start, stop):
+        """Sorted row positions between two sorted indexes. """
+        positions = self._order[start:stop]
+        # Large slices sorted through a mask (linear) instead of a sort
+        if len(positions) * 16 > self._n_rows:
+            mask = np.zeros(self._n_rows, dtype=bool)
+            mask[positions] = True
+            return np.flatnonzero(mask)
+        return np.sort(positions)
+
+    def positions(self, oper, crit):
+        """Sorted positions of the rows respecting "oper(row, crit)",
+        or None if the filter cannot use the index. """
+        if (not isinstance(crit, numbers.Real) or isinstance(crit, bool)
+                or np.isnan(crit)):
+            return None
+        valid = self._sorted[:self._n_valid]
+        if oper in (op.eq, op.ne):
+            start = np.searchsorted(valid, crit, 'left')
+            stop = np.searchsorted(valid, crit, 'right')
+            equal = self._slice(start, stop)
+            if oper is op.eq:
+                return equal
+            return _complement(equal, self._n_rows)
+        if oper is op.lt:
+            return self._slice(0, np.searchsorted(valid, crit, 'left'))
+        if oper is op.le:
+            return self._slice(0, np.searchsorted(valid, crit, 'right'))
+        if oper is op.gt:
+            return self._slice(np.searchsorted(valid, crit, 'right'),
+                               self._n_valid)
+        if oper is op.ge:
+            return self._slice(np.searchsorted(valid, crit, 'left'),
+                               self._n_valid)
+        return None
+
+
+class InvertedIndex:
+    """Index of a categorical or string column, for equality filters.
+
+    Each distinct value gives the sorted positions of its rows.
+    """
+
+    def __init__(self, values):
+        """Build the index of a column (any values). """
+        import pandas as pd
+        codes, uniques = pd.factorize(values)
+        self._n_rows = len(codes)
+        # Rows grouped by code (stable sort : positions stay sorted),
+        # missing values (code -1) first
+        self._order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes + 1, minlength=len(uniques) + 1)
+        self._starts = np.concatenate([[0], np.cumsum(counts)])
+        self._codes = {value: code for (code, value) in enumerate(uniques)}
+
+    def positions(self, oper, crit):
+        """Sorted positions of the rows respecting "oper(row, crit)",
+        or None if the filter cannot use the index. """
+        if oper not in (op.eq, op.ne):
+            return None
+        try:
+            code = self._codes.get(crit)
+        except TypeError: # unhashable criterion
+            return None
+        if code is None:
+            equal = np.array([], dtype=np.intp)
+        else:
+            equal = self._order[self._starts[code+1]:self._starts[code+2]]
+        if oper is op.eq:
+            return equal
+        return _complement(equal, self._n_rows)
+
+
+class ColumnStatistics:
+    """Statistics of a column, for the estimation of the fraction of
+    rows respecting a filter (selectivity).
+
+    Computed on a regular sample of the rows : quantiles of the numbers
+    (equi-depth histogram), or frequencies of the other values.
+    """
+
+    SAMPLE_SIZE = 10000
+    N_QUANTILES = 64
+
+    def __init__(self, column):
+        """Statistics of a column (pandas serie). """
+        step = max(1, len(column) // self.SAMPLE_SIZE)
+        sample = column.iloc[::step]
+        self._numeric = column.dtype.kind in 'biuf'
+        if self._numeric:
+            values = sample.to_numpy(dtype=float)
+            values = values[~np.isnan(values)]
+            self._valid = len(values) / max(1, len(sample))
+            if len(values) == 0:
+                self._quantiles = np.array([])
+            else:
+                self._quantiles = np.quantile(
+                    values, np.linspace(0, 1, self.N_QUANTILES + 1))
+        else:
+            self._frequencies = sample.value_counts(normalize=True,
+                                                    dropna=False).to_dict()
+
+    def selectivity(self, oper, crit):
+        """Estimated fraction of the rows respecting "oper(row, crit)"
+        (1 if unknown : filter evaluated last). """
+        if self._numeric:
+            return self._numeric_selectivity(oper, crit)
+        if oper not in (op.eq, op.ne):
+            return 1.
+        try:
+            equal = self._frequencies.get(crit, 0.)
+        except TypeError: # unhashable criterion
+            return 1.
+        return equal if oper is op.eq else 1. - equal
+
+    def _numeric_selectivity(self, oper, crit):
+        if (not isinstance(crit, numbers.Real) or isinstance(crit, bool)
+                or np.isnan(crit)):
+            return 1.
+        n = len(self._quantiles)
+        if n == 0:
+            return 0. if oper is not op.ne else 1.
+        lower = np.searchsorted(self._quantiles, crit, 'left') / n
+        upper = np.searchsorted(self._quantiles, crit, 'right') / n
+        # NaN never respect a comparison, except "!="
+        fractions = {op.eq: upper - lower,
+                     op.lt: lower,
+                     op.le: upper,
+                     op.gt: 1. - upper,
+                     op.ge: 1. - lower}
+        if oper is op.ne:
+            return 1. - fractions[op.eq] * self._valid
+        return fractions.get(oper, 1. / self._valid) * self._valid
+
+
+def _complement(positions, n_rows):
+    """Sorted positions of the rows not in "positions". """
+    mask = np.ones(n_rows, dtype=bool)
+    mask[positions] = False
+    return np.flatnonzero(mask)
+
+
+def build_index(column):
+    """Index adapted to a column (pandas serie) : sorted index for
+    numbers, inverted index otherwise. None for dates and durations :
+    the criterion typed in the GUI (string) is converted by pandas
+    when the column is scanned, not by the index. """
+    if column.dtype.kind in 'mM':
+        return None
+    if column.dtype.kind in 'biuf':
+        return SortedIndex(column.to_numpy())
+    return InvertedIndex(column)
@@ -0,0 +1,246 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import os
+import time
+import uuid
+import pickle
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    """Raised in a job which was cancelled (superseded by a newer
+    request). """
+
+
+class Job:
+    """Handle given to the function of a job : progress report and
+    cancellation check.
+
+    Attributes
+    ----------
+    job_id : str
+        Id of the job.
+    """
+
+    def __init__(self, queue, job_id):
+        self._queue = queue
+        self.job_id = job_id
+
+    @property
+    def cancelled(self):
+        """True if the job was cancelled. """
+        return self._queue._is_cancelled(self.job_id)
+
+    def progress(self, done, total=None, text=""):
+        """Report the progress of the job ("done" steps of "total",
+        and a description). Raise JobCancelled if the job was
+        cancelled : called between the steps of the work. """
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+        self._queue._write_status(self.job_id, state='running', done=done,
+                                  total=total, text=text)
+
+
+class JobQueue:
+    """Local queue of background jobs.
+
+    Jobs run in a pool of threads (NumPy and pandas release the GIL on
+    the heavy work; workbooks can also be parsed by processes, see
+    DataManager). Their status, progress and result are written in a
+    folder, one sub-folder per job : any process of the server can
+    poll a job or cancel it, without external broker. The result of a
+    batch job (see "submit_batch") is written item by item, each item
+    being read on its own. Job folders are removed "max_age" seconds
+    after their creation.
+
+    Status of a job : dict with
+        - 'state' : "queued", "running", "done", "error" or "cancelled"
+        - 'done', 'total', 'text' : last progress reported
+        - 'error' : error message (state "error")
+
+    Attributes
+    ----------
+    directory : string
+        Folder of the jobs (created if needed).
+    max_age : float
+        Lifetime of the job folders, in seconds.
+    """
+
+    _STATUS_FILE = "status.pkl"
+    _RESULT_FILE = "result.pkl"
+    _ITEM_FILE = "result_{0}.pkl"
+    _CANCEL_FILE = "cancel"
+
+    def __init__(self, directory, workers=2, max_age=3600.):
+        self.directory = directory
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _path(self, job_id, file_name=None):
+        # Only the characters of the ids generated by "submit"
+        job_id = "".join(c for c in str(job_id) if c.isalnum())
+        if file_name is None:
+            return os.path.join(self.directory, job_id)
+        return os.path.join(self.directory, job_id, file_name)
+
+    def _write(self, job_id, file_name, value):
+        """Write a file of a job at once (readers never see a partial
+        file). """
+        (fd, tmp_path) = tempfile.mkstemp(dir=self._path(job_id),
+                                          prefix=".tmp")
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(job_id, file_name))
+
+    def _write_status(self, job_id, state, done=None, total=None, text="",
+                      error=None):
+        self._write(job_id, self._STATUS_FILE,
+                    {'state': state, 'done': done, 'total': total,
+                     'text': text, 'error': error})
+
+    def _is_cancelled(self, job_id):
+        return os.path.exists(self._path(job_id, self._CANCEL_FILE))
+
+    def submit(self, function, *args, **kwargs):
+        """Run "function(job, *args, **kwargs)" in the background, "job"
+        being the Job handle of the work. Return the job id. """
+        return self._submit(function, args, kwargs, batch=False)
+
+    def submit_batch(self, function, *args, **kwargs):
+        """Same as "submit", for a function returning a list : each
+        item of the result is written in its own file, read alone by
+        "result(job_id, item)" (a request needing one item does not
+        load the whole batch). """
+        return self._submit(function, args, kwargs, batch=True)
+
+    def _submit(self, function, args, kwargs, batch):
+        self._clean()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._path(job_id))
+        self._write_status(job_id, 'queued')
+        future = self._executor.submit(self._run, job_id, function,
+                                       args, kwargs, batch)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._forget(job_id))
+        return job_id
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _run(self, job_id, function, args, kwargs, batch):
+        job = Job(self, job_id)
+        try:
+            job.progress(0)
+            result = function(job, *args, **kwargs)
+            if batch:
+                for (item, value) in enumerate(result):
+                    self._write(job_id, self._ITEM_FILE.format(item), value)
+            else:
+                self._write(job_id, self._RESULT_FILE, result)
+            self._write_status(job_id, 'done')
+        except JobCancelled:
+            self._write_status(job_id, 'cancelled')
+        except Exception as e:
+            print(e)
+            self._write_status(job_id, 'error', error=str(e))
+
+    def cancel(self, job_id):
+        """Cancel a job : not started if still queued, stopped at its
+        next progress report if running. """
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            self._write_status(job_id, 'cancelled')
+            return
+        try:
+            with open(self._path(job_id, self._CANCEL_FILE), 'wb'):
+                pass
+        except FileNotFoundError: # unknown or removed job
+            pass
+
+    def status(self, job_id):
+        """Status of a job (see the class description), or None if the
+        job is unknown. """
+        try:
+            with open(self._path(job_id, self._STATUS_FILE), 'rb') as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def wait(self, job_id, timeout):
+        """Wait at most "timeout" seconds for the end of a job. Return
+        its status. """
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+            return self.status(job_id)
+        # Job of another process : status polled
+        limit = time.monotonic() + timeout
+        while True:
+            status = self.status(job_id)
+            if (status is None or status['state'] in
+                    ('done', 'error', 'cancelled') or
+                    time.monotonic() > limit):
+                return status
+            time.sleep(0.05)
+
+    def result(self, job_id, item=None):
+        """Result of a job done, or its item number "item" for a batch
+        job (see "submit_batch"). """
+        if item is None:
+            file_name = self._RESULT_FILE
+        else:
+            file_name = self._ITEM_FILE.format(int(item))
+        with open(self._path(job_id, file_name), 'rb') as file:
+            return pickle.load(file)
+
+    def _clean(self):
+        """Remove the folders of the jobs older than "max_age". """
+        limit = time.time() - self.max_age
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir() and entry.stat().st_ctime < limit:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                except OSError:
+                    pass
+
+
+def main():
+    def count(job, n_steps):
+        for step in range(n_steps):
+            job.progress(step, n_steps, "counting")
+            time.sleep(0.1)
+        return n_steps
+
+    queue = JobQueue(tempfile.mkdtemp())
+    first = queue.submit(count, 5)
+    print("Status :", queue.wait(first, 0.25))
+    # A newer request supersedes the first one
+    queue.cancel(first)
+    second = queue.submit(count, 3)
+    print("First :", queue.wait(first, 1)['state'])
+    print("Second :", queue.wait(second, 1)['state'],
+          "- result :", queue.result(second))
+    # Batch : items read one by one
+    batch = queue.submit_batch(lambda job, n: list(range(n)), 3)
+    queue.wait(batch, 1)
+    print("Batch item 2 :", queue.result(batch, 2))
+    shutil.rmtree(queue.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import time
+import numpy as np
+
+from .indexes import build_index, ColumnStatistics
+
+
+def convert_criterion(crit):
+    """Convert a criterion typed in the GUI (string) to the value used
+    in the comparison : float if numeric, unchanged otherwise. """
+    if isinstance(crit, str) and crit.isnumeric():
+        return float(crit)
+    return crit
+
+
+class MaskEngine:
+    """Cache of the rows selected by the subsets.
+
+    Each subset (var, operator, criterion) is resolved once for a given
+    dataset version, through a column index built on first use (sorted
+    index for numbers, inverted index for other values, see "indexes")
+    or by a scan of the column if the index cannot answer.
+    The rows are stored in the most compact form : sorted positions
+    for selective subsets, packed mask (one bit per row) otherwise.
+    Several subsets are combined by a simple query plan : they are
+    ordered by estimated selectivity (exact row count if the subset is
+    known, else from sampled column statistics), the most selective is
+    resolved first and the next ones are only evaluated on the
+    remaining rows. Replotting with known subsets does not scan any
+    column.
+
+    Attributes
+    ----------
+    version : int
+        Version of the dataset the masks are computed on.
+    last_plan : list of dicts
+        Steps of the last combination of subsets (see "plan_report").
+    """
+
+    def __init__(self):
+        self._dataframe = None
+        self.version = None
+        self._rows = {}
+        self._indexes = {}
+        self._stats = {}
+        self._combined = {}
+        self.last_plan = []
+
+    def set_dataframe(self, dataframe, version):
+        """Define the dataset (masks of other versions are dropped). """
+        if version != self.version:
+            self._rows = {}
+            self._indexes = {}
+            self._stats = {}
+            self._combined = {}
+        self._dataframe = dataframe
+        self.version = version
+
+    @property
+    def n_rows(self):
+        return len(self._dataframe)
+
+    def _index(self, var):
+        """Index of a column (built on first use), or None if the
+        column name is not unique. """
+        try:
+            return self._indexes[var]
+        except KeyError:
+            pass
+        column = self._dataframe[var]
+        index = build_index(column) if column.ndim == 1 else None
+        self._indexes[var] = index
+        return index
+
+    def _subset_rows(self, var, oper, crit):
+        """Rows of a subset, as a tupple ("positions", sorted positions)
+        or ("packed", packed mask). Computed if not in the cache. """
+        key = (self.version, var, oper, crit)
+        try:
+            return self._rows[key]
+        except KeyError:
+            pass
+        converted_crit = convert_criterion(crit)
+        index = self._index(var)
+        positions = None
+        if index is not None:
+            positions = index.positions(oper, converted_crit)
+        if positions is None:
+            values = oper(self._dataframe[var], converted_crit)
+            positions = np.flatnonzero(np.asarray(values, dtype=bool)
+                                       .squeeze())
+        # Positions kept if smaller than the packed mask (n_rows / 8)
+        if self.n_rows < 2**32:
+            positions = positions.astype(np.uint32)
+        if len(positions) * positions.itemsize * 8 < self.n_rows:
+            rows = ("positions", positions)
+        else:
+            rows = ("packed", np.packbits(self._positions_to_mask(positions)))
+        self._rows[key] = rows
+        return rows
+
+    def _positions_to_mask(self, positions):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[positions] = True
+        return mask
+
+    def _to_packed(self, rows):
+        (kind, values) = rows
+        if kind == "packed":
+            return values
+        return np.packbits(self._positions_to_mask(values))
+
+    def _unpack(self, packed_mask):
+        return np.unpackbits(packed_mask, count=self.n_rows).view(bool)
+
+    def mask(self, var, oper, crit):
+        """Boolean array of the rows respecting a subset. """
+        (kind, values) = self._subset_rows(var, oper, crit)
+        if kind == "positions":
+            return self._positions_to_mask(values)
+        return self._unpack(values)
+
+    def _row_count(self, rows):
+        (kind, values) = rows
+        if kind == "positions":
+            return len(values)
+        return int(np.unpackbits(values, count=self.n_rows).sum())
+
+    def _selectivity(self, var, oper, crit):
+        """Fraction of the rows respecting a subset : exact if the
+        subset is known, estimated from the column statistics else. """
+        rows = self._rows.get((self.version, var, oper, crit))
+        if rows is not None:
+            return self._row_count(rows) / max(1, self.n_rows)
+        try:
+            stats = self._stats[var]
+        except KeyError:
+            column = self._dataframe[var]
+            stats = ColumnStatistics(column) if column.ndim == 1 else None
+            self._stats[var] = stats
+        if stats is None:
+            return 1.
+        return stats.selectivity(oper, convert_criterion(crit))
+
+    def _filter_positions(self, positions, var, oper, crit):
+        """Positions (sorted) respecting a subset among "positions"
+        and the name of the method used. """
+        rows = self._rows.get((self.version, var, oper, crit))
+        if rows is not None:
+            (kind, values) = rows
+            if kind == "positions":
+                return (np.intersect1d(positions, values, assume_unique=True),
+                        "cache")
+            bits = (values[positions >> 3] >> (7 - (positions & 7))) & 1
+            return positions[bits.astype(bool)], "cache"
+        column = self._dataframe[var].iloc[positions]
+        keep = np.asarray(oper(column, convert_criterion(crit)), dtype=bool)
+        return positions[keep.reshape(len(positions))], "remaining rows"
+
+    def combined_positions(self, subsets):
+        """Sorted positions of the rows respecting all the subsets
+        (list of tupples (var, operator, criterion)), or None if there
+        is no subset (no filtering). The steps are stored in
+        "last_plan". """
+        if len(subsets) == 0:
+            self.last_plan = []
+            return None
+        combined_key = (self.version, frozenset(subsets))
+        if combined_key in self._combined:
+            positions = self._combined[combined_key]
+            self.last_plan = [{'subset': None, 'estimate': None,
+                               'method': "cache", 'rows': len(positions),
+                               'time': 0.}]
+            return positions
+
+        # Plan : subsets by increasing estimated selectivity
+        plan = sorted(({'subset': subset,
+                        'estimate': self._selectivity(*subset)}
+                       for subset in set(subsets)),
+                      key=lambda step: step['estimate'])
+
+        positions = None
+        for step in plan:
+            start = time.perf_counter()
+            if positions is None:
+                known = (self.version, *step['subset']) in self._rows
+                (kind, values) = self._subset_rows(*step['subset'])
+                positions = (values if kind == "positions"
+                             else np.flatnonzero(self._unpack(values)))
+                step['method'] = "cache" if known else "full evaluation"
+            else:
+                (positions, step['method']) = self._filter_positions(
+                    positions, *step['subset'])
+            step['rows'] = len(positions)
+            step['time'] = time.perf_counter() - start
+        self._combined[combined_key] = positions
+        self.last_plan = plan
+        return positions
+
+    def combined_mask(self, subsets):
+        """Boolean array of the rows respecting all the subsets
+        (list of tupples (var, operator, criterion)), or an empty
+        list if there is no subset (no filtering). """
+        if len(subsets) == 0:
+            self.last_plan = []
+            return []
+        return self._positions_to_mask(self.combined_positions(subsets))
+
+    def plan_report(self):
+        """Description of the last combination of subsets : for each
+        step, the subset, its estimated selectivity, the evaluation
+        method, the number of remaining rows and the time spent. """
+        lines = []
+        for (step_i, step) in enumerate(self.last_plan):
+            if step['subset'] is None:
+                subset = "all subsets"
+                estimate = "-"
+            else:
+                (var, oper, crit) = step['subset']
+                subset = "{0} {1} {2!r}".format(var, oper.__name__, crit)
+                estimate = "{0:.1%}".format(step['estimate'])
+            lines.append("{0}. {1} (estimate {2}) : {3}, {4} rows, "
+                         "{5:.2f} ms".format(step_i + 1, subset, estimate,
+                                             step['method'], step['rows'],
+                                             1000 * step['time']))
+        total = sum(step['time'] for step in self.last_plan)
+        lines.append("Total : {0:.2f} ms".format(1000 * total))
+        return "\n".join(lines)
+
+
+def main():
+    import operator as op
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    n_rows = 1000000
+    dataframe = pd.DataFrame({('x', '-'): rng.normal(size=n_rows),
+                              ('y', '-'): rng.uniform(size=n_rows),
+                              ('z', '-'): rng.choice(['a', 'b', 'c'], n_rows)})
+    subsets = [(('y', '-'), op.lt, 0.9),
+               (('z', '-'), op.ne, 'a'),
+               (('x', '-'), op.gt, 2.5)]
+
+    start = time.perf_counter()
+    mask = np.logical_and.reduce([oper(dataframe[var], crit).to_numpy()
+                                  for (var, oper, crit) in subsets])
+    print("Full evaluation of each subset : {0:.2f} ms".format(
+        1000 * (time.perf_counter() - start)))
+
+    engine = MaskEngine()
+    engine.set_dataframe(dataframe, 1)
+    planned_mask = engine.combined_mask(subsets)
+    print(engine.plan_report())
+    print("Same rows :", bool((planned_mask == mask).all()))
+
+    # Other threshold : the index of "x" is reused
+    subsets[2] = (('x', '-'), op.gt, 2.)
+    engine.combined_mask(subsets)
+    print(engine.plan_report())
+
+    # Dates compared to a date typed in the GUI (string)
+    dates = pd.DataFrame({('t', 's'): pd.date_range("2020-01-01",
+                                                    periods=1000, freq='h')})
+    engine.set_dataframe(dates, 2)
+    for oper in (op.eq, op.ne, op.ge):
+        expected = oper(dates[('t', 's')], "2020-01-02").to_numpy()
+        same = bool((engine.mask(('t', 's'), oper, "2020-01-02")
+                     == expected).all())
+        print("Same rows (dates, {0}) :".format(oper.__name__), same)
+        assert same
+
+
+if __name__ == "__main__":
+    main()
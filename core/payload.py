@@ -0,0 +1,120 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import base64
+import json
+import time
+import numpy as np
+
+
+# Typed arrays decoded by plotly.js (no 64 bits integers)
+_INT_TYPES = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+
+
+def _smallest_int_type(values):
+    """Smallest integer type decoded by plotly.js holding all the
+    values, or None. """
+    if len(values) == 0:
+        return np.int8
+    (low, high) = (values.min(), values.max())
+    for int_type in _INT_TYPES:
+        info = np.iinfo(int_type)
+        if info.min <= low and high <= info.max:
+            return int_type
+    return None
+
+
+def typed_array(values, float32=False):
+    """Binary encoding of a numeric array for plotly.js : dict of the
+    type ("dtype"), the base64 bytes ("bdata") and, for arrays of more
+    than one dimension, the shape.
+
+    Integers use the smallest type holding them. With "float32", floats
+    are sent in simple precision if the values are kept to a relative
+    precision of 1e-6 (else in double precision).
+    Returns None if the array cannot be encoded (not numeric).
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'b':
+        values = values.astype(np.uint8)
+    elif values.dtype.kind in 'iu':
+        int_type = _smallest_int_type(values)
+        values = values.astype(np.float64 if int_type is None else int_type)
+    elif values.dtype.kind == 'f':
+        values = values.astype(np.float64)
+        if float32:
+            with np.errstate(over='ignore'):
+                values32 = values.astype(np.float32)
+            if np.allclose(values32, values, rtol=1e-6, atol=0,
+                           equal_nan=True):
+                values = values32
+    else:
+        return None
+    encoded = {'dtype': values.dtype.str[1:],
+               'bdata': base64.b64encode(
+                   np.ascontiguousarray(values).tobytes()).decode('ascii')}
+    if values.ndim > 1:
+        encoded['shape'] = ", ".join(str(n) for n in values.shape)
+    return encoded
+
+
+def _decode_typed_array(encoded):
+    """NumPy array of a typed array. """
+    values = np.frombuffer(base64.b64decode(encoded['bdata']),
+                           dtype=np.dtype(encoded['dtype']))
+    if 'shape' in encoded:
+        values = values.reshape([int(n) for n in
+                                 str(encoded['shape']).split(",")])
+    return values
+
+
+def encode_arrays(obj, float32=False):
+    """Copy of a figure (or part of a figure, as given by
+    "to_plotly_json") with its numeric NumPy arrays replaced by typed
+    arrays (see "typed_array"). Typed arrays already encoded by Plotly
+    (version 6 and above) are kept, or downcast with "float32". """
+    if isinstance(obj, np.ndarray):
+        encoded = typed_array(obj, float32)
+        return obj if encoded is None else encoded
+    if isinstance(obj, dict) and 'bdata' in obj and 'dtype' in obj:
+        if float32 and obj['dtype'] == 'f8':
+            return typed_array(_decode_typed_array(obj), float32)
+        return obj
+    if isinstance(obj, dict):
+        return {key: encode_arrays(value, float32)
+                for (key, value) in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [encode_arrays(value, float32) for value in obj]
+    return obj
+
+
+def payload_metrics(obj):
+    """Size (bytes) of the JSON payload of a figure and the time spent
+    to serialize it (seconds), as a dict. """
+    # Imported on first use (not needed to start the server)
+    from plotly.utils import PlotlyJSONEncoder
+    start = time.perf_counter()
+    payload = json.dumps(obj, cls=PlotlyJSONEncoder)
+    return {'size': len(payload),
+            'serialize_time': time.perf_counter() - start}
+
+
+def main():
+    rng = np.random.default_rng(0)
+    trace = {'type': 'scattergl',
+             'x': rng.normal(size=100000),
+             'y': rng.integers(0, 1000, 100000)}
+    plain = {'data': [{key: value.tolist() if isinstance(value, np.ndarray)
+                       else value for (key, value) in trace.items()}]}
+    figure = {'data': [trace]}
+    for (name, obj) in (("JSON lists", plain),
+                        ("Typed arrays", encode_arrays(figure)),
+                        ("Typed arrays, float32",
+                         encode_arrays(figure, True))):
+        metrics = payload_metrics(obj)
+        print("{0} : {1:.0f} kB, {2:.1f} ms".format(
+            name, metrics['size'] / 1000, 1000 * metrics['serialize_time']))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,8 @@ class _Plotter:
     """Abstract class used as a base for graph plotters.
     
     Store a dataframe as data source, and allow filtering on it,
-    tanks to a subset list. 
+    tanks to a subset list. The rows respecting the subsets are kept
+    as positions : only the columns needed by the plot are sliced.
 
     Attributes
     ----------
@@ -23,7 +24,7 @@ class _Plotter:
         Dataframe sliced thanks to the subsets.  
     """
     
-    def __init__(self, *, dataframe, subsets = [], **kwargs):
+    def __init__(self, *, dataframe, subsets = [], masker = None, **kwargs):
         """Creation of a Plotter object.
         
         Every plotter need data, given by the dataframe.
@@ -37,11 +38,16 @@ class _Plotter:
             Data container.
         subsets : list of tupples (str var, operator, float value)
             Filters to apply on data. The default is [] (no filters).
+        masker : function
+            Function giving the sorted positions of the rows respecting
+            a list of subsets (None if no filtering), used instead of
+            evaluating the subsets on the dataframe (for instance
+            a cache of masks). The default is None.
         """
         self._dataframe = dataframe
         self._subsets = subsets
-        self._mask = self._mask_from_subsets()
-        self._masked_dataframe = self._build_masked_dataframe()
+        self._masker = masker
+        self._positions = self._positions_from_subsets()
         
     def _update(self):
         """Update the object attributes.
@@ -50,8 +56,7 @@ class _Plotter:
         called to update the slicing. This method should be
         extended in children classes in order to update figures. 
         """
-        self._mask = self._mask_from_subsets()
-        self._masked_dataframe = self._build_masked_dataframe()
+        self._positions = self._positions_from_subsets()
 
     @property
     def subsets(self):
@@ -83,31 +88,41 @@ class _Plotter:
     @property
     def masked_dataframe(self):
         """Pandas dataframe corresponding to a slice of the input
-        dataframe respecting the filters defined in "subsets". 
+        dataframe respecting the filters defined in "subsets"
+        (all the columns : copy built on demand). 
         """
-        return self.masked_dataframe
+        if self._positions is None:
+            return self._dataframe
+        return self._dataframe.iloc[self._positions]
         
-    def _mask_from_subsets(self):
-        """Build a mask (boolean serie) by applying filters
-        (contained in "subsets") to the data ("dataframe").
+    def _positions_from_subsets(self):
+        """Sorted positions of the rows respecting the filters
+        (contained in "subsets"), or None if there is no filter.
         """
+        if self._masker is not None:
+            return self._masker(self._subsets)
         if len(self._subsets) == 0:
-            return []
+            return None
         else:
             masks = []
             for (var, oper, crit) in self._subsets:
                 masks.append(oper(self._dataframe[var], crit))
-            return np.logical_and.reduce([m.squeeze() for m in masks])
+            return np.flatnonzero(np.logical_and.reduce([m.squeeze()
+                                                         for m in masks]))
                                      
-    def _build_masked_dataframe(self):
-        """Apply a mask (boolean serie) to a dataframe in order
-        to slice it to keep usefull data only.
+    def _selected_dataframe(self, variables, rows = "filtered"):
+        """Slice of the dataframe restricted to the rows respecting
+        the filters (or to the given sorted positions "rows", None
+        for all the rows) and to the given columns : only these
+        columns are copied.
         """
-        if len(self._mask) == 0:
-            masked_df = self._dataframe
-        else:
-            masked_df = self._dataframe.loc[self._mask,:]
-        return masked_df
+        if isinstance(rows, str):
+            rows = self._positions
+        if rows is None:
+            return self._dataframe
+        variables = list(dict.fromkeys(variables))
+        cols_i = self._dataframe.columns.get_indexer_for(variables)
+        return self._dataframe.iloc[rows, cols_i]
     
 
 class ParCoorPlot(_Plotter):
@@ -121,11 +136,18 @@ class ParCoorPlot(_Plotter):
     All the attributes from parent class _Plotter, plus :
     varlist : list
         List of variables to plot.
+    max_rows : int
+        Maximum number of rows plotted (sampled by sheet above).
+    max_dims : int
+        Maximum number of axes when "varlist" is None.
+    pinned : list
+        Variables always plotted when "varlist" is None.
     figure : plotly figure object
         Parallel coordinates plot. 
     """
     
-    def __init__(self, *, varlist = None, **kwargs):
+    def __init__(self, *, varlist = None, encoder = None, max_rows = None,
+                 max_dims = None, pinned = None, seed = 0, **kwargs):
         """Creation of a ParCoorPlot object.
         
         Inherited from _Plotter.
@@ -136,22 +158,53 @@ class ParCoorPlot(_Plotter):
         varlist : list
             List of variables to plot (each variable is an axis).
             Variables are defined by tupples (var name, var unit).
+        encoder : function
+            Function giving the encoding of a non numeric column of
+            the whole dataframe : tupple (codes, values) as given by
+            "pandas.factorize" (for instance a cache of encodings).
+            The default is None (columns encoded at each update).
+        max_rows : int
+            Maximum number of rows plotted. Above, the rows are
+            sampled at random in each sheet (first level of the
+            dataframe index), in proportion of the sheet rows.
+            The default is None (all the rows).
+        max_dims : int
+            Maximum number of axes when "varlist" is None : the
+            "pinned" variables, then the numeric variables of highest
+            variance (values scaled to [0, 1]). The default is None
+            (all the variables).
+        pinned : list
+            Variables always plotted when "varlist" is None.
+            The default is None.
+        seed : int
+            Seed of the row sampling (same rows for the same data).
+            The default is 0.
         """
         super(ParCoorPlot, self).__init__(**kwargs)
         self._varlist = varlist
+        self._encoder = encoder
+        self._max_rows = max_rows
+        self._max_dims = max_dims
+        self._pinned = [] if pinned is None else pinned
+        self._seed = seed
         self._figure_dict = {}
+        self._figure_layout = {}
         self._update_figure_data()
-        self._figure = go.Figure(data=go.Parcoords(self._figure_dict))
+        self._figure = go.Figure(data=go.Parcoords(self._figure_dict),
+                                 layout=self._figure_layout)
         
     def _update(self):  
         """ Extended update method to add figure update. """
         super()._update()
         self._update_figure_data()
+        self._figure = go.Figure(data=go.Parcoords(self._figure_dict),
+                                 layout=self._figure_layout)
         
     @property
     def varlist(self):
         """List of variables to plot (one axis per variable).
-        if "None" is given, all the variables will be plotted.
+        if "None" is given, all the variables will be plotted
+        (at most "max_dims").
         """
         return self._varlist
 
@@ -160,6 +213,39 @@ class ParCoorPlot(_Plotter):
         """Call to the update method after parameter change. """
         self._varlist = varlist
         self._update()
+
+    @property
+    def max_rows(self):
+        """Maximum number of rows plotted. """
+        return self._max_rows
+
+    @max_rows.setter
+    def max_rows(self, max_rows):
+        """Call to the update method after parameter change. """
+        self._max_rows = max_rows
+        self._update()
+
+    @property
+    def max_dims(self):
+        """Maximum number of axes when "varlist" is None. """
+        return self._max_dims
+
+    @max_dims.setter
+    def max_dims(self, max_dims):
+        """Call to the update method after parameter change. """
+        self._max_dims = max_dims
+        self._update()
+
+    @property
+    def pinned(self):
+        """Variables always plotted when "varlist" is None. """
+        return self._pinned
+
+    @pinned.setter
+    def pinned(self, pinned):
+        """Call to the update method after parameter change. """
+        self._pinned = pinned
+        self._update()
             
     @property
     def figure(self):
@@ -168,31 +254,96 @@ class ParCoorPlot(_Plotter):
     
     def _update_figure_data(self):
         """ Definition of the figure parameters. """
+        (rows, n_rows) = self._sampled_positions()
         if self._varlist == None:
-            vars_to_plot = self._dataframe.columns.values
+            vars_to_plot = self._default_variables(rows)
         else:
             vars_to_plot = self._varlist
+
+        notes = []
+        if rows is not self._positions:
+            notes.append("{0} of {1} rows shown".format(len(rows), n_rows))
+        if len(vars_to_plot) < self._dataframe.shape[1] and \
+                self._varlist == None:
+            notes.append("{0} of {1} variables shown".format(
+                len(vars_to_plot), self._dataframe.shape[1]))
+        self._figure_layout = {}
+        if notes:
+            self._figure_layout["title"] = {"text": ", ".join(notes)}
         
         labels = {v : v[0] + " (" + v[1] + ")" for v in vars_to_plot}
+        selected_df = self._selected_dataframe(vars_to_plot, rows)
         dims = []
         for v in vars_to_plot:
             dim = {}
             dim["label"] = labels[v]
-            if pd.api.types.is_numeric_dtype(self._masked_dataframe[v]):
-                dim["values"] = self._masked_dataframe[v]
+            if pd.api.types.is_numeric_dtype(selected_df[v]):
+                dim["values"] = selected_df[v]
             else:
-                tickvals = self._masked_dataframe[v].values
-                tickset = []
-                for tv in tickvals:
-                    if tv not in tickset:
-                        tickset.append(tv)
-                tickdic = {tv: i for (i, tv) in enumerate(tickset)} 
-                dim["ticktext"] = tickset
-                dim["tickvals"] = [tickdic[tv] for tv in tickset]
-                dim["values"] = [tickdic[tv] for tv in tickvals]
+                (codes, tickset) = self._encoding(v, selected_df, rows)
+                dim["ticktext"] = list(tickset)
+                dim["tickvals"] = list(range(len(tickset)))
+                dim["values"] = codes
             dims.append(dim)
         self._figure_dict["dimensions"] = dims
 
+    def _sampled_positions(self):
+        """Positions of the rows to plot (None : all the rows) and the
+        number of filtered rows. Above "max_rows" rows, the rows are
+        sampled in each sheet (stratified sampling). """
+        positions = self._positions
+        if positions is None:
+            n_rows = len(self._dataframe)
+        else:
+            n_rows = len(positions)
+        if self._max_rows is None or n_rows <= self._max_rows:
+            return positions, n_rows
+        if positions is None:
+            positions = np.arange(n_rows)
+        sheets = self._dataframe.index.get_level_values(0)
+        strata = pd.factorize(sheets.take(positions))[0]
+        sample = _stratified_sample(strata, self._max_rows, self._seed)
+        return positions[sample], n_rows
+
+    def _default_variables(self, rows):
+        """Variables plotted when "varlist" is None : all, or at most
+        "max_dims" (pinned variables, then numeric variables of highest
+        variance), in the dataframe order. """
+        columns = self._dataframe.columns
+        if self._max_dims is None or len(columns) <= self._max_dims:
+            return columns.values
+        chosen = set(self._pinned[:self._max_dims])
+        numeric = [v for v in columns.values if v not in chosen and
+                   self._dataframe[v].ndim == 1 and
+                   self._dataframe[v].dtype.kind in 'biuf']
+        if numeric and len(chosen) < self._max_dims:
+            cols_i = columns.get_indexer_for(numeric)
+            values = self._dataframe.iloc[slice(None) if rows is None
+                                          else rows, cols_i]
+            values = values.to_numpy(dtype=float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                low = np.nanmin(values, axis=0)
+                scaled = (values - low) / (np.nanmax(values, axis=0) - low)
+                variances = np.nan_to_num(np.nanvar(scaled, axis=0))
+            best = np.argsort(-variances, kind='stable')
+            chosen.update(numeric[i]
+                          for i in best[:self._max_dims - len(chosen)])
+        return [v for v in columns.values if v in chosen]
+
+    def _encoding(self, var, selected_df, rows):
+        """Codes of the values of a non numeric variable for the
+        plotted rows, and the values (ticks) in order of first
+        appearance in these rows. """
+        if self._encoder is None:
+            return pd.factorize(_column_values(selected_df, var),
+                                use_na_sentinel=False)
+        (codes, values) = self._encoder(var)
+        if rows is None:
+            return codes, values
+        # Codes of the whole column re-indexed on the rows present
+        (codes, present) = pd.factorize(codes[rows])
+        return codes, values[present]
+
 
 class ScatterPlot(_Plotter):
     """Class designed to build a scatter plot.
@@ -212,11 +363,31 @@ class ScatterPlot(_Plotter):
     z_var : tupple
         ID of the variable for the coloring
         (tupple (var name, unit name)).
+    max_series : int
+        Maximum number of series for a numeric z variable : above,
+        a single serie colored by a color scale is plotted.
+    render : str
+        Rendering mode : "auto", "svg", "webgl" or "density".
+    rendering : str
+        Rendering mode used for the figure ("svg", "webgl" or
+        "density").
+    max_points : int
+        Number of points above which the series are decimated.
+    x_range, y_range : list
+        Zoomed window [min, max] of each axis (None : whole data).
     figure : plotly figure object
         Parallel coordinates plot. 
     """
+
+    # Number of points from which the "auto" render uses WebGL, then
+    # a density heatmap computed on the server side
+    WEBGL_POINTS = 20000
+    DENSITY_POINTS = 500000
+    DENSITY_BINS = 200
     
-    def __init__(self, *, x_var, y_var, z_var = None, **kwargs):
+    def __init__(self, *, x_var, y_var, z_var = None, max_series = 50,
+                 render = "auto", max_points = None, x_range = None,
+                 y_range = None, **kwargs):
         """Creation of a scatter plot object.
         
         Inherited from _Plotter.
@@ -233,19 +404,47 @@ class ScatterPlot(_Plotter):
         z_var : tupple
             ID of the variable for the coloring
             (tupple (var name, unit name)).
+        max_series : int
+            Maximum number of series (one per z value) for a numeric
+            z variable. Above, a single serie is plotted, colored by
+            the z values with a color scale. The default is 50.
+        render : str
+            "svg" (scatter traces), "webgl" (scattergl traces, for
+            large data), "density" (2D histogram computed on the
+            server side, colored by the number of points or by the
+            mean of a numeric z variable), or "auto" (chosen from the
+            number of points, see WEBGL_POINTS and DENSITY_POINTS).
+            The default is "auto".
+        max_points : int
+            Number of points above which the series are decimated on
+            a grid, keeping in each cell the points of minimum and
+            maximum y (shape and outliers preserved). The default is
+            None (no decimation).
+        x_range, y_range : list
+            Zoomed window [min, max] of each axis : only the rows
+            inside are plotted (and decimated). The default is None
+            (whole data).
         """
         super(ScatterPlot, self).__init__(**kwargs)
         self._x_var = x_var
         self._y_var = y_var
         self._z_var = z_var
-        self._figure_list = []
+        self._max_series = max_series
+        self._render = render
+        self._rendering = None
+        self._max_points = max_points
+        self._x_range = x_range
+        self._y_range = y_range
         self._update_figure_data()
-        self._figure = go.Figure(data=self._figure_list)
+        self._figure = go.Figure(data=self._figure_list,
+                                 layout=self._figure_layout)
         
     def _update(self): 
         """ Extended update method to add figure update. """
         super()._update()
         self._update_figure_data()
+        self._figure = go.Figure(data=self._figure_list,
+                                 layout=self._figure_layout)
         
     @property
     def x_var(self):
@@ -279,6 +478,66 @@ class ScatterPlot(_Plotter):
         """ Extended update method to add figure update. """
         self._z_var = z_var
         self._update()
+
+    @property
+    def max_series(self):
+        """ Maximum number of series for a numeric z variable. """
+        return self._max_series
+
+    @max_series.setter
+    def max_series(self, max_series):
+        """ Extended update method to add figure update. """
+        self._max_series = max_series
+        self._update()
+
+    @property
+    def render(self):
+        """ Rendering mode ("auto", "svg", "webgl" or "density"). """
+        return self._render
+
+    @render.setter
+    def render(self, render):
+        """ Extended update method to add figure update. """
+        self._render = render
+        self._update()
+
+    @property
+    def rendering(self):
+        """ Rendering mode used for the figure. """
+        return self._rendering
+
+    @property
+    def max_points(self):
+        """ Number of points above which the series are decimated. """
+        return self._max_points
+
+    @max_points.setter
+    def max_points(self, max_points):
+        """ Extended update method to add figure update. """
+        self._max_points = max_points
+        self._update()
+
+    @property
+    def x_range(self):
+        """ Zoomed window [min, max] of the X-axis. """
+        return self._x_range
+
+    @x_range.setter
+    def x_range(self, x_range):
+        """ Extended update method to add figure update. """
+        self._x_range = x_range
+        self._update()
+
+    @property
+    def y_range(self):
+        """ Zoomed window [min, max] of the Y-axis. """
+        return self._y_range
+
+    @y_range.setter
+    def y_range(self, y_range):
+        """ Extended update method to add figure update. """
+        self._y_range = y_range
+        self._update()
             
     @property
     def figure(self):
@@ -286,32 +545,286 @@ class ScatterPlot(_Plotter):
         return self._figure
         
     def _update_figure_data(self): 
-        """ Definition of the figure parameters. """
+        """ Definition of the figure parameters.
+
+        With a z variable, rows are grouped in one pass : codes of the
+        z values (factorize), then a stable sort of the rows by code,
+        each serie being a contiguous block of the sorted rows.
+        A numeric z variable with more than "max_series" values is
+        plotted as a single serie colored by a color scale.
+        Above "max_points" points, the series are decimated (first
+        paint), the zoomed windows being decimated again from the
+        filtered rows.
+        """
         (x_label, y_label) = [v[0] + " (" + v[1] + ")" for v in (self.x_var,
                                                                  self.y_var)]
+        self._figure_list = []
+        self._figure_layout = {}
         if self.z_var == None:
-            z_label = None
+            selected_df = self._selected_dataframe([self._x_var,
+                                                    self._y_var])
+        else:
+            selected_df = self._selected_dataframe([self._x_var,
+                                                    self._y_var,
+                                                    self._z_var])
+        selected_df = self._zoomed_dataframe(selected_df)
+        self._rendering = self._rendering_mode(selected_df)
+        if self._rendering == "density":
+            self._figure_list.append(self._density_serie(selected_df))
+            return
+        trace_type = "scattergl" if self._rendering == "webgl" else "scatter"
+        decimate = (self._max_points is not None and
+                    len(selected_df) > self._max_points)
+
+        if self.z_var == None and not decimate:
+            serie = {}
+            serie["type"] = trace_type
+            serie["x"] = selected_df[self._x_var].squeeze()
+            serie["y"] = selected_df[self._y_var].squeeze()
+            self._figure_list.append(serie)
+            return
+
+        # Rows grouped by z value (missing z values excluded)
+        if self.z_var == None:
+            z_column = None
+            order = np.arange(len(selected_df))
             z_values = [None]
-            z_legends = [None]
+            bounds = np.array([0, len(selected_df)])
         else:
             z_label = self.z_var[0] + " (" + self._z_var[1] + ")"
-            z_values = set(self._masked_dataframe[self._z_var])
-            z_legends = [z_label + " = " + str(v) for v in z_values]
-        
-        for (z_leg, z_val) in zip(z_legends, z_values):
+            z_column = _column_values(selected_df, self._z_var)
+            (order, z_values, bounds) = _group_rows(z_column)
+            order = order[bounds[0]:]
+            bounds = bounds - bounds[0]
+        continuous = (z_column is not None and
+                      z_column.dtype.kind in 'iuf' and
+                      len(z_values) > self._max_series)
+        x_values = _column_values(selected_df, self._x_var)[order]
+        y_values = _column_values(selected_df, self._y_var)[order]
+
+        if decimate:
+            groups = None if continuous else np.repeat(np.arange(len(z_values)),
+                                                       np.diff(bounds))
+            kept = self._decimation(x_values, y_values, groups)
+            order = order[kept]
+            x_values = x_values[kept]
+            y_values = y_values[kept]
+            bounds = np.searchsorted(kept, bounds)
+            self._figure_layout["title"] = {
+                "text": "{0} of {1} points shown (zoom to refine)"
+                        .format(len(kept), len(selected_df))}
+
+        if self.z_var == None:
             serie = {}
-            serie["type"] = "scatter"
-            if z_val == None:
-                sliced_df = self._masked_dataframe
+            serie["type"] = trace_type
+            serie["x"] = x_values
+            serie["y"] = y_values
+            self._figure_list.append(serie)
+        elif continuous:
+            serie = {}
+            serie["type"] = trace_type
+            serie["mode"] = "markers"
+            serie["name"] = z_label
+            serie["x"] = x_values
+            serie["y"] = y_values
+            serie["marker"] = {"color": z_column[order],
+                               "colorscale": "Viridis",
+                               "showscale": True,
+                               "colorbar": {"title": {"text": z_label}}}
+            self._figure_list.append(serie)
+        else:
+            for (z_val, start, stop) in zip(z_values, bounds[:-1],
+                                            bounds[1:]):
+                serie = {}
+                serie["type"] = trace_type
+                serie["name"] = z_label + " = " + str(z_val)
+                serie["x"] = x_values[start:stop]
+                serie["y"] = y_values[start:stop]
+                self._figure_list.append(serie)
+
+    def _decimation(self, x_values, y_values, groups):
+        """Positions of the points kept by the grid decimation : the
+        grid is refined (cells split in 4) while less than half of
+        "max_points" points are kept. """
+        n_cells = max(1, int(np.sqrt(self._max_points / 2)))
+        kept = _grid_decimation(x_values, y_values, groups, n_cells)
+        while len(kept) < self._max_points / 2 and n_cells < 2**12:
+            finer_kept = _grid_decimation(x_values, y_values, groups,
+                                          2 * n_cells)
+            if len(finer_kept) > self._max_points:
+                break
+            (kept, n_cells) = (finer_kept, 2 * n_cells)
+        return kept
+
+    def _zoomed_dataframe(self, selected_df):
+        """Rows of the zoomed window (numeric axes only), and window
+        kept in the figure layout. """
+        for (var, axis_range, axis) in ((self._x_var, self._x_range, "xaxis"),
+                                        (self._y_var, self._y_range, "yaxis")):
+            if axis_range is None:
+                continue
+            self._figure_layout[axis] = {"range": list(axis_range)}
+            values = _column_values(selected_df, var)
+            if values.dtype.kind in 'biuf':
+                inside = ((values >= axis_range[0]) &
+                          (values <= axis_range[1]))
+                selected_df = selected_df.iloc[np.flatnonzero(inside)]
+        return selected_df
+
+    def _rendering_mode(self, selected_df):
+        """Rendering mode of the figure, from "render" and the number
+        of points (after decimation : no density if decimated). The
+        density needs numeric x and y variables. """
+        numeric = all(_column_values(selected_df, v).dtype.kind in 'biuf'
+                      for v in (self._x_var, self._y_var))
+        if self._render == "auto":
+            n_points = len(selected_df)
+            if self._max_points is not None:
+                n_points = min(n_points, self._max_points)
+            if n_points >= self.DENSITY_POINTS and numeric:
+                return "density"
+            if n_points >= self.WEBGL_POINTS:
+                return "webgl"
+            return "svg"
+        if self._render == "density" and not numeric:
+            return "webgl"
+        return self._render
+
+    def _density_serie(self, selected_df):
+        """Heatmap of the number of points in each cell of a regular
+        grid (NumPy 2D histogram), or of the mean z value if the z
+        variable is numeric. Empty cells are not colored. """
+        x_values = _column_values(selected_df, self._x_var).astype(float)
+        y_values = _column_values(selected_df, self._y_var).astype(float)
+        valid = np.isfinite(x_values) & np.isfinite(y_values)
+        z_values = None
+        if self.z_var != None:
+            z_column = _column_values(selected_df, self._z_var)
+            if z_column.dtype.kind in 'biuf':
+                z_values = z_column.astype(float)
+                valid &= np.isfinite(z_values)
+                z_values = z_values[valid]
+        x_values = x_values[valid]
+        y_values = y_values[valid]
+
+        (counts, x_edges, y_edges) = np.histogram2d(x_values, y_values,
+                                                    bins=self.DENSITY_BINS)
+        serie = {}
+        serie["type"] = "heatmap"
+        serie["x"] = (x_edges[:-1] + x_edges[1:]) / 2
+        serie["y"] = (y_edges[:-1] + y_edges[1:]) / 2
+        serie["colorscale"] = "Viridis"
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if z_values is None:
+                serie["name"] = "points"
+                serie["z"] = np.where(counts > 0, counts, np.nan).T
+                serie["colorbar"] = {"title": {"text": "points"}}
             else:
-                mask = op.eq(self._masked_dataframe[self._z_var], z_val)
-                sliced_df = self._masked_dataframe.loc[mask.squeeze(), :]
-                serie["name"] = z_leg
+                z_label = self.z_var[0] + " (" + self._z_var[1] + ")"
+                (z_sums, x_edges, y_edges) = np.histogram2d(
+                    x_values, y_values, bins=(x_edges, y_edges),
+                    weights=z_values)
+                serie["name"] = z_label
+                serie["z"] = (z_sums / counts).T
+                serie["colorbar"] = {"title": {"text": z_label}}
+        return serie
 
-            serie["x"] = sliced_df[self._x_var].squeeze()
-            serie["y"] = sliced_df[self._y_var].squeeze()
-            self._figure_list.append(serie)
-        pass
+
+def _column_values(dataframe, var):
+    """Values (NumPy array) of a column of a dataframe. """
+    column = dataframe[var]
+    if column.ndim == 2: # duplicated column name
+        column = column.squeeze(axis=1)
+    return column.to_numpy()
+
+
+def _grid_coordinates(values):
+    """Values as floats, for the decimation grid (codes for non
+    numeric values, NaN for missing values). """
+    if values.dtype.kind in 'biuf':
+        return values.astype(float)
+    if values.dtype.kind in 'mM':
+        coordinates = values.view('int64').astype(float)
+        coordinates[np.isnat(values)] = np.nan
+        return coordinates
+    codes = pd.factorize(values)[0].astype(float)
+    codes[codes < 0] = np.nan
+    return codes
+
+
+def _grid_decimation(x_values, y_values, groups, n_cells):
+    """Max-min decimation on a grid.
+
+    The (x, y) plane is divided in "n_cells" x "n_cells" cells over the
+    range of the points. In each cell (and each group of rows, if
+    "groups" is given), only the points of minimum and maximum y are
+    kept : the shape of the cloud and the isolated points (outliers)
+    are preserved. Points with missing coordinates are dropped.
+    The result is deterministic.
+
+    Returns the sorted positions of the points kept.
+    """
+    x_coords = _grid_coordinates(x_values)
+    y_coords = _grid_coordinates(y_values)
+    valid = np.flatnonzero(np.isfinite(x_coords) & np.isfinite(y_coords))
+    if len(valid) == 0:
+        return valid
+    cells = np.zeros(len(valid), dtype=np.int64)
+    for coords in (x_coords[valid], y_coords[valid]):
+        (low, high) = (coords.min(), coords.max())
+        scale = n_cells / (high - low) if high > low else 0.
+        cell_i = np.minimum(((coords - low) * scale).astype(np.int64),
+                            n_cells - 1)
+        cells = cells * n_cells + cell_i
+    if groups is not None:
+        cells += groups[valid] * n_cells**2
+    # Points of minimum and maximum y of each cell (index : positions)
+    grouped = pd.Series(y_coords[valid], index=valid).groupby(cells,
+                                                             sort=False)
+    return np.union1d(grouped.idxmin().to_numpy(),
+                      grouped.idxmax().to_numpy())
+
+
+def _stratified_sample(strata, n_sample, seed):
+    """Stratified random sampling.
+
+    "strata" gives the stratum (integer code) of each row. The number
+    of rows sampled in each stratum is proportional to its size (largest
+    remainders for the rounding), the rows of a stratum being drawn at
+    random with a given seed. Returns the sorted positions sampled.
+    """
+    counts = np.bincount(strata)
+    quotas = counts * n_sample / counts.sum()
+    sampled = np.floor(quotas).astype(np.int64)
+    remainders = np.argsort(-(quotas - sampled), kind='stable')
+    sampled[remainders[:n_sample - sampled.sum()]] += 1
+
+    # Rows sorted by stratum, then by random key : first rows kept
+    keys = np.random.default_rng(seed).random(len(strata))
+    order = np.lexsort((keys, strata))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sorted_strata = strata[order]
+    rank = np.arange(len(order)) - starts[sorted_strata]
+    return np.sort(order[rank < sampled[sorted_strata]])
+
+
+def _group_rows(values):
+    """Group the rows by value.
+
+    Returns a tupple (order, group values, bounds) : the rows of the
+    i-th group value are "order[bounds[i]:bounds[i+1]]" (positions in
+    increasing order). Groups are sorted by value when possible (else
+    in order of first appearance). Missing values are not grouped.
+    """
+    try:
+        (codes, uniques) = pd.factorize(values, sort=True)
+    except TypeError: # values not comparable
+        (codes, uniques) = pd.factorize(values)
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes + 1, minlength=len(uniques) + 1)
+    # Missing values (code -1) sorted first, excluded by the bounds
+    bounds = np.cumsum(counts)
+    return order, uniques, bounds
 
 
 def main():
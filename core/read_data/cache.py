@@ -0,0 +1,156 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class WorkbookCache:
+    """On-disk cache of parsed workbooks.
+
+    Each workbook is identified by a hash of its bytes. Its dataframe
+    is stored by columns : one NumPy ".npy" file per numeric, boolean
+    or datetime column (memory-mapped when read back), and a pickle
+    for the other columns (strings, mixed types), the indexes and the
+    informations stored with the dataframe (sheet comments, variables
+    mapping...).
+    Entries are evicted in least recently used order when the total
+    size of the cache exceeds "max_size".
+
+    Attributes
+    ----------
+    directory : string
+        Cache folder (created if needed).
+    max_size : int
+        Maximum size of the cache, in bytes.
+    """
+
+    # Entries written with another format version are ignored
+    _FORMAT_VERSION = 2
+    _META_FILE = "meta.pkl"
+
+    def __init__(self, directory, max_size=2**30):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(content):
+        """Key of a workbook : hash of its bytes. """
+        return hashlib.blake2b(content, digest_size=20).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return the tupple (dataframe, infos) stored for a key,
+        or None if the key is not in the cache. """
+        entry_path = self._entry_path(key)
+        meta_path = os.path.join(entry_path, self._META_FILE)
+        try:
+            with open(meta_path, 'rb') as file:
+                meta = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if meta['version'] != self._FORMAT_VERSION:
+            return None
+
+        # Columns rebuilt by position (column names may be duplicated)
+        import pandas as pd
+        columns = {}
+        for col_i in range(len(meta['columns'])):
+            if col_i in meta['objects']:
+                columns[col_i] = meta['objects'][col_i]
+            else:
+                col_path = os.path.join(entry_path, "c{0}.npy".format(col_i))
+                columns[col_i] = np.load(col_path, mmap_mode='r')
+        dataframe = pd.DataFrame(data=columns, index=meta['index'],
+                                 copy=False)
+        dataframe.columns = meta['columns']
+
+        # Access time update for the LRU eviction
+        os.utime(meta_path)
+        return dataframe, meta['infos']
+
+    def put(self, key, dataframe, infos):
+        """Store a parsed workbook, with a dict of picklable
+        informations, then evict the least recently used entries if
+        the cache is too large. """
+        entry_path = self._entry_path(key)
+        if os.path.isdir(entry_path):
+            return
+        tmp_path = tempfile.mkdtemp(dir=self.directory, prefix=".tmp")
+        objects = {}
+        for col_i in range(dataframe.shape[1]):
+            column = dataframe.iloc[:, col_i]
+            # Series dtype : the array of a NumPy column has a pandas
+            # dtype (NumpyEADtype) with pandas 2 and above
+            if (isinstance(column.dtype, np.dtype) and
+                    column.dtype.kind in "biufcmM"):
+                np.save(os.path.join(tmp_path, "c{0}.npy".format(col_i)),
+                        column.to_numpy())
+            else:
+                objects[col_i] = column.array
+        meta = {'version': self._FORMAT_VERSION,
+                'index': dataframe.index,
+                'columns': dataframe.columns,
+                'objects': objects,
+                'infos': infos}
+        with open(os.path.join(tmp_path, self._META_FILE), 'wb') as file:
+            pickle.dump(meta, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Entry published at once (a concurrent writer may be first)
+        try:
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries above "max_size". """
+        entries = []
+        for key in os.listdir(self.directory):
+            entry_path = self._entry_path(key)
+            if key.startswith(".") or not os.path.isdir(entry_path):
+                continue
+            try:
+                files = [os.path.join(entry_path, f)
+                         for f in os.listdir(entry_path)]
+                size = sum(os.path.getsize(f) for f in files)
+                last_use = os.path.getmtime(os.path.join(entry_path,
+                                                         self._META_FILE))
+            except OSError:
+                continue
+            entries.append((last_use, size, entry_path))
+        total_size = sum(size for (last_use, size, path) in entries)
+        for (last_use, size, path) in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+
+
+def main():
+    import time
+    from . import xlsx
+    cache = WorkbookCache(tempfile.mkdtemp())
+    filepath = os.path.join(os.path.dirname(__file__),
+                            "..", "..", "data", "test3.xlsx")
+    content = xlsx.file_content(filepath)
+    key = cache.key(content)
+    dataframe, comments = xlsx.read_workbook(filepath)
+    cache.put(key, dataframe, {'comments': comments})
+    start = time.perf_counter()
+    cached_dataframe, infos = cache.get(key)
+    print("Cache read : {0:.1f} ms".format(1000*(time.perf_counter()-start)))
+    print(cached_dataframe.equals(dataframe), infos['comments'] == comments)
+    shutil.rmtree(cache.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,120 +1,119 @@
 #! /usr/bin/env python3
 # coding: utf-8
 
+import io
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
 import openpyxl as xl
 import pandas as pd
 
 
-def boundaries_range(first_cell_column,
-                     first_cell_row,
-                     last_cell_column,
-                     last_cell_row):
-    """Convert 2 cell coordinates into a range as a string"""
-    
-    # Input checks
-    if (first_cell_column > last_cell_column or
-        last_cell_row > last_cell_row):
-        raise ValueError("Invalid input : wrong cell order for a range")
-    
-    # Conversion process
-    letter = xl.utils.cell.get_column_letter
-    str_first_cell = letter(first_cell_column) + str(first_cell_row)
-    str_last_cell = letter(last_cell_column) + str(last_cell_row)
-    return str_first_cell + ":" + str_last_cell
+def _row_bounds(row):
+    """Return the indexes of the first and last not-empty cells of a
+    row of values, or None if all the cells are empty."""
+    first_i = next((i for i, v in enumerate(row) if v is not None), None)
+    if first_i is None:
+        return None
+    last_i = len(row) - 1 - next(i for i, v in enumerate(reversed(row))
+                                 if v is not None)
+    return first_i, last_i
 
 
-def worksheet_clean_range(sheet, cell_range):
+def rows_to_dataframe(title, rows):
     """
-    Return a range corresponding to the input range cleaned
-    of any fully empty row/column around the data. Empty
-    row/column in the middle of the data are not detected.
+    Store the data contained in an iterable of worksheet rows in a
+    pandas.DataFrame. Each row is visited only once : the range
+    cleaning, the comments detection and the split between names,
+    units and values are all done during the same pass.
 
     Parameters
     ----------
-    sheet : openpyxl.worksheet.worksheet.Worksheet
-        Excel-type worksheet defined as part of a workbook
-        in openpyxl.
-    cell_range : string
-        Excel type range as a string. For example "A1:B2"
+    title : string
+        Worksheet name, used as first level of the indexes.
+    rows : iterable of tuples
+        Cell values of the worksheet, row by row (as returned by
+        openpyxl "iter_rows(values_only=True)"). Rows are expected
+        to start on the same column. The layout constraints are the
+        ones described in "worksheet_to_dataframe".
 
     Returns
     -------
-    Range as a string, or None if all cells in the range are
-    empty or if the range is out of the worksheet bounds.
-
+    dataframe : pandas.DataFrame
+        Dataframe containing the data of the rows (same format as
+        "worksheet_to_dataframe").
+    comments : string
+        Comments found before the data. Cells content is separated by
+        a whitespace, rows by a line break. Empty string if no comment.
     """
-    
-    # Get range boundaries coordinates
-    (input_first_col_i,
-     input_first_row_i,
-     input_last_col_i,
-     input_last_row_i) = xl.utils.cell.range_boundaries(cell_range)
-    
-    # Check if worksheet bounds are not crossed
-    # Otherwise, index omissions can happen inside iter_rows and
-    # lead to wrong row index
-    input_first_col_i = max(input_first_col_i, sheet.min_column)
-    input_first_row_i = max(input_first_row_i, sheet.min_row)
-    input_last_col_i = min(input_last_col_i, sheet.max_column)
-    input_last_row_i = min(input_last_row_i, sheet.max_row)
-    if (input_first_col_i > input_last_col_i or 
-        input_first_row_i > input_last_row_i):
-        raise ValueError("Input range out of worksheet bounds")
-
-    # Get first not-empty row
-    cleaned_first_row_i = input_first_row_i
-    row_iterable = sheet.iter_rows(min_row=input_first_row_i,
-                                   max_row=input_last_row_i,
-                                   min_col=input_first_col_i,
-                                   max_col=input_last_col_i)
-    for i, row in enumerate(row_iterable):
-        row_i = input_first_row_i + i
-        if all([cell.value is None for cell in row]):
-            cleaned_first_row_i = row_i + 1
-        else:
-            break
-        
-    # Empty range case
-    if cleaned_first_row_i > input_last_row_i:
-        return None
-    
-    # Get last not-empty row
-    cleaned_last_row_i = input_last_row_i
-    row_iterable = sheet.iter_rows(min_row=cleaned_first_row_i,
-                                   max_row=input_last_row_i,
-                                   min_col=input_first_col_i,
-                                   max_col=input_last_col_i)
-    for rev_i, row in enumerate(reversed(list(row_iterable))):
-        row_i = input_last_row_i - rev_i
-        if all([cell.value is None for cell in row]):
-            cleaned_last_row_i = row_i - 1
+
+    # Rows are split in blocks : the first group of not-empty rows is
+    # a comment block if it is followed by empty row(s) and by data.
+    # Empty rows inside the data block are kept, trailing ones are not.
+    comment_block = None
+    block = []
+    block_len = 0 # number of rows up to the last not-empty one
+    first_col_i = last_col_i = None
+    for row in rows:
+        bounds = _row_bounds(row)
+        if bounds is None:
+            if not block:
+                continue # leading empty rows, or gap after comments
+            if comment_block is None:
+                comment_block = (block, first_col_i, last_col_i)
+                block = []
+                block_len = 0
+                first_col_i = last_col_i = None
+            else:
+                block.append(row)
+            continue
+        block.append(row)
+        block_len = len(block)
+        if first_col_i is None:
+            (first_col_i, last_col_i) = bounds
         else:
-            break    
-        
-    # Get first and last not-empty columns
-    cleaned_first_col_i = input_last_col_i # init : only last col filled
-    cleaned_last_col_i = input_first_col_i # init : only first col filled
-    for row in sheet.iter_rows(min_row=cleaned_first_row_i,
-                               max_row=cleaned_last_row_i,
-                               min_col=input_first_col_i,
-                               max_col=input_last_col_i):
-        row_cells_are_empty = [cell.value == None for cell in row]
-        try:
-            first_nonempty_i = row_cells_are_empty.index(False)
-            row_first_col_i = input_first_col_i + first_nonempty_i
-            last_nonempty_i = row_cells_are_empty[::-1].index(False)
-            row_last_col_i = input_last_col_i - last_nonempty_i
-        except:
-            pass # no action if an empty row exists in the data
-        cleaned_first_col_i = min(cleaned_first_col_i, row_first_col_i)
-        cleaned_last_col_i = max(cleaned_last_col_i, row_last_col_i)
-        
-    # Range construction and return
-    return boundaries_range(cleaned_first_col_i,
-                            cleaned_first_row_i,
-                            cleaned_last_col_i,
-                            cleaned_last_row_i)
-    
+            first_col_i = min(first_col_i, bounds[0])
+            last_col_i = max(last_col_i, bounds[1])
+
+    # No data after the first block : it is the data itself
+    if not block:
+        if comment_block is None:
+            raise ValueError("Empty worksheet : no data found")
+        (block, first_col_i, last_col_i) = comment_block
+        block_len = len(block)
+        comment_block = None
+    data_rows = block[:block_len]
+
+    # comments stored as a string
+    if comment_block is None:
+        comments = ""
+    else:
+        comments = "\n".join(" ".join(str(v) for v in row if v is not None)
+                              for row in comment_block[0])
+
+    # Data range split to get libs, units & values
+    libs = [row[first_col_i] for row in data_rows]
+    units = [row[first_col_i+1] for row in data_rows]
+    vals = [row[first_col_i+2:last_col_i+1] for row in data_rows]
+
+    # Transposing values to get single data type per column for faster
+    # pandas processing
+    vals = [*zip(*vals)]
+
+    # Defining indexes and column names as tuples, and converting them
+    # to multi-indexes
+    index_tuples = [(title, str(pt)) for pt in range(1,len(vals)+1)]
+    multi_index = pd.MultiIndex.from_tuples(index_tuples)
+    column_tuples = [*zip(libs, units)]
+    multi_column = pd.MultiIndex.from_tuples(column_tuples)
+
+    # Pandas Dataframe creation and return
+    dataframe = pd.DataFrame(data=vals,
+                             index=multi_index,
+                             columns=multi_column)
+    return dataframe, comments
+
 
 def worksheet_to_dataframe(ws):
     """
@@ -145,96 +144,70 @@ def worksheet_to_dataframe(ws):
         Column names are also tupples of strings :
         (data_name, data_unit)
     """
-        
-    # Clean worksheet range to remove empty rows/column around the data
-    all_range = worksheet_clean_range(ws, ws.calculate_dimension())
-
-    # Get range boundaries coordinates
-    (first_col_i,
-     first_row_i,
-     last_col_i,
-     last_row_i) = xl.utils.cell.range_boundaries(all_range)
-
-    # Iteration on rows from last to first to find last cell before
-    # empty row(s) to identify potential comments
-    last_h_row_i = None
-    first_d_row_i = first_row_i
-    for i, row in enumerate(ws.iter_rows(min_row=first_row_i,
-                                            max_row=last_row_i)):
-        # comment presence detected and last comment line index saved
-        if all([cell.value is None for cell in row]):
-            if last_h_row_i == None:    
-                last_h_row_i = first_row_i + i - 1
-        # Else, if comment previously detected, first non-empty
-        # line after comment saved as first data line
-        elif last_h_row_i != None:
-            first_d_row_i = first_row_i + i
-            break
-        
-    # comments stored as a string
-    comments = ""
-    for row in ws.iter_rows(min_row=first_row_i,
-                               max_row=last_h_row_i):
-        line = [str(cell.value) for cell in row if cell.value != None]
-        if bool(line) and bool(comments): # Empty list/str == False
-            comments += "\n"
-        separator = " "
-        comments += separator.join(line)
-        
-    # Cleaning of the data range
-    data_range = boundaries_range(first_col_i,
-                                  first_d_row_i,
-                                  last_col_i,
-                                  last_row_i)
-    data_range = worksheet_clean_range(ws, data_range)
-    (first_d_col_i,
-     first_d_row_i,
-     last_d_col_i,
-     last_d_row_i) = xl.utils.cell.range_boundaries(data_range)
-    
-    # Data range split to get libs, units & values
-    libs_range = boundaries_range(first_d_col_i,
-                                  first_d_row_i,
-                                  first_d_col_i,
-                                  last_d_row_i)
-    units_range = boundaries_range(first_d_col_i+1,
-                                   first_d_row_i,
-                                   first_d_col_i+1,
-                                   last_d_row_i)
-    vals_range = boundaries_range(first_d_col_i+2,
-                                   first_d_row_i,
-                                   last_d_col_i,
-                                   last_d_row_i)
-    libs = [row[0].value for row in ws[libs_range]]
-    units = [row[0].value for row in ws[units_range]]
-    vals = [[cell.value for cell in row] for row in ws[vals_range]]
-    
-    # Transposing values to get single data type per column for faster
-    # pandas processing
-    vals = [*zip(*vals)]
-    
-    # Defining indexes and column names as tuples, and converting them
-    # to multi-indexes
-    index_tuples = [(ws.title, str(pt)) for pt in range(1,len(vals)+1)]
-    multi_index = pd.MultiIndex.from_tuples(index_tuples)
-    column_tuples = [*zip(libs, units)]
-    multi_column = pd.MultiIndex.from_tuples(column_tuples)
-    
-    # Pandas Dataframe creation and return
-    return pd.DataFrame(data=vals,
-                        index=multi_index,
-                        columns=multi_column)
+    # Single pass on the worksheet rows (values only, no cell objects)
+    dataframe, comments = rows_to_dataframe(ws.title,
+                                            ws.iter_rows(values_only=True))
+    return dataframe
+
 
+# Workbook opened once by each process of the pool (see
+# "read_workbook"), to avoid sending the file for each sheet
+_worker_workbook = None
 
-def workbook_to_dataframe(filepath):
+
+def _load_workbook(filepath, engine):
+    """Open a workbook with the given engine ("openpyxl" or "stream").
+    The stream engine falls back to openpyxl (with a warning) if it
+    cannot handle the workbook structure. """
+    if engine == 'stream':
+        from . import xlsx_stream
+        try:
+            return xlsx_stream.StreamWorkbook(filepath)
+        except xlsx_stream.UnsupportedWorkbookError as e:
+            warnings.warn("Stream engine : {0}, read with openpyxl"
+                          .format(e))
+    elif engine != 'openpyxl':
+        raise ValueError("Unknown engine : " + str(engine))
+    return xl.load_workbook(filepath, read_only=True, data_only=True)
+
+
+def _read_sheet(ws):
+    """Process a worksheet opened by any engine.
+    Return a tupple (dataframe, comments). """
+    if hasattr(ws, 'to_dataframe'):
+        return ws.to_dataframe()
+    return rows_to_dataframe(ws.title, ws.iter_rows(values_only=True))
+
+
+def _init_worker(content, engine):
+    """Open the workbook bytes in a pool process. """
+    global _worker_workbook
+    _worker_workbook = _load_workbook(io.BytesIO(content), engine)
+
+
+def _worker_read_sheet(sheet_i):
+    """Process the sheet number "sheet_i" in a pool process. """
+    return _read_sheet(_worker_workbook.worksheets[sheet_i])
+
+
+def file_content(filepath):
+    """Return the bytes of a file given as a path or as a file object. """
+    if hasattr(filepath, 'read'):
+        filepath.seek(0)
+        return filepath.read()
+    with open(filepath, 'rb') as file:
+        return file.read()
+
+
+def read_workbook(filepath, workers=1, engine='openpyxl'):
     """
-    Load a workbook and store the data contained in each sheet
-    in a separate pandas.Dataframe. The workbook must respect
-    a correct format.
+    Load a workbook, store the data contained in each sheet in a
+    pandas.Dataframe and keep the comments of each sheet. The workbook
+    must respect a correct format.
 
     Parameters
     ----------
-    filepath : string
+    filepath : string or file object
         Filepath to an Excel workbook to load. All worksheets
         are loaded and values are extracted. All sheets must
         respect the following constraints :
@@ -247,6 +220,16 @@ def workbook_to_dataframe(filepath):
               be concatenated (whitespace as separator). These
               comments must be separated from the data by at
               least one empty row.
+    workers : int or None
+        Number of processes used to parse the sheets in parallel.
+        Each process opens the workbook bytes itself. With 1 (default),
+        sheets are processed one after another in the current process.
+        None means one process per CPU.
+    engine : string
+        "openpyxl" (default) to read the cells through openpyxl, or
+        "stream" to parse the sheets XML straight from the archive
+        into NumPy buffers (faster on large sheets). openpyxl is used
+        as fallback if the stream engine cannot read the workbook.
 
     Returns
     -------
@@ -256,20 +239,123 @@ def workbook_to_dataframe(filepath):
         (worksheet_name, point_index_starting_at_1)
         Column names are also tupples of strings :
         (data_name, data_unit)
+    comments : dict
+        Comments of each worksheet (string), by worksheet name.
     """
-    # Workbook loading and closure
-    wb = xl.load_workbook(filepath, read_only=True, data_only=True)
-    
-    # Empty list to store dataframes for each processed worksheet
-    sheet_dataframes = []
-    
-    # Each sheet is processed independently
-    for ws in wb.worksheets:
-        sheet_dataframes.append(worksheet_to_dataframe(ws))
+    sheets = read_sheets(filepath, workers=workers, engine=engine)
         
     # Concatenation of the dataframes for the different worksheets
-    concat_dataframe = pd.concat(sheet_dataframes)
+    concat_dataframe = pd.concat([df for (title, df, ws_comments) in sheets])
+    comments = {title: ws_comments for (title, df, ws_comments) in sheets}
     
+    return concat_dataframe, comments
+    
+
+def read_sheets(filepath, sheet_indexes=None, workers=1, engine='openpyxl',
+                progress=None):
+    """
+    Load some sheets of a workbook, each one in its own
+    pandas.Dataframe. Same parameters as "read_workbook", plus :
+
+    Parameters
+    ----------
+    sheet_indexes : list of int or None
+        Indexes (workbook order) of the sheets to read. All the sheets
+        are read if None (default).
+    progress : callable or None
+        Function called with the number of sheets read and the number
+        of sheets to read, before reading and after each sheet. An
+        exception raised by this function stops the reading. The default
+        is None.
+
+    Returns
+    -------
+    sheets : list of tupples (title, dataframe, comments)
+        One tupple per sheet read, in the "sheet_indexes" order.
+    """
+    if workers is None:
+        workers = os.cpu_count()
+
+    # Workbook loading
+    wb = _load_workbook(filepath, engine)
+    if sheet_indexes is None:
+        sheet_indexes = range(len(wb.worksheets))
+    titles = [wb.worksheets[sheet_i].title for sheet_i in sheet_indexes]
+    n_sheets = len(titles)
+    
+    # Each sheet is processed independently, the dataframes are
+    # stored in the sheets order
+    sheet_results = []
+    try:
+        if progress is not None:
+            progress(0, n_sheets)
+        if workers <= 1 or n_sheets <= 1:
+            for sheet_i in sheet_indexes:
+                sheet_results.append(_read_sheet(wb.worksheets[sheet_i]))
+                if progress is not None:
+                    progress(len(sheet_results), n_sheets)
+        else:
+            content = file_content(filepath)
+            with ProcessPoolExecutor(max_workers=min(workers, n_sheets),
+                                     initializer=_init_worker,
+                                     initargs=(content, engine)) as executor:
+                futures = [executor.submit(_worker_read_sheet, sheet_i)
+                           for sheet_i in sheet_indexes]
+                try:
+                    for future in futures:
+                        sheet_results.append(future.result())
+                        if progress is not None:
+                            progress(len(sheet_results), n_sheets)
+                except BaseException:
+                    # Sheets not started yet are not parsed
+                    for future in futures:
+                        future.cancel()
+                    raise
+    finally:
+        # Workbook closure
+        wb.close()
+
+    return [(title, df, ws_comments)
+            for (title, (df, ws_comments)) in zip(titles, sheet_results)]
+
+
+def sheet_fingerprints(filepath):
+    """
+    Hash the content of each sheet of a workbook, without parsing the
+    sheets (see "xlsx_stream.StreamWorksheet.fingerprint").
+
+    Returns
+    -------
+    fingerprints : list of tupples (title, fingerprint) or None
+        One tupple per sheet, in the workbook order. None if the
+        workbook structure is not recognised.
+    """
+    from . import xlsx_stream
+    try:
+        wb = xlsx_stream.StreamWorkbook(filepath)
+    except xlsx_stream.UnsupportedWorkbookError:
+        return None
+    fingerprints = [(ws.title, ws.fingerprint()) for ws in wb.worksheets]
+    wb.close()
+    return fingerprints
+
+
+def workbook_to_dataframe(filepath, workers=1, engine='openpyxl'):
+    """
+    Load a workbook and store the data contained in each sheet
+    in a separate pandas.Dataframe. The workbook must respect
+    a correct format (see "read_workbook" for the parameters).
+
+    Returns
+    -------
+    concat_dataframe : pandas.DataFrame
+        Dataframe containing the data of the input workbook.
+        Indexes (points) are defined as tupples of strings :
+        (worksheet_name, point_index_starting_at_1)
+        Column names are also tupples of strings :
+        (data_name, data_unit)
+    """
+    concat_dataframe, comments = read_workbook(filepath, workers, engine)
     return concat_dataframe
     
 
@@ -0,0 +1,555 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import hashlib
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+from openpyxl.styles.numbers import (builtin_format_code,
+                                     is_date_format,
+                                     is_timedelta_format)
+from openpyxl.utils.cell import column_index_from_string
+from openpyxl.utils.datetime import (from_excel,
+                                     from_ISO8601,
+                                     MAC_EPOCH,
+                                     WINDOWS_EPOCH)
+
+
+# XML namespaces and tags of the parts read in the archive
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_ROW_TAG = _NS_MAIN + "row"
+_VALUE_TAG = _NS_MAIN + "v"
+_INLINE_TAG = _NS_MAIN + "is"
+_TEXT_TAG = _NS_MAIN + "t"
+_RUN_TAG = _NS_MAIN + "r"
+_STRING_TAG = _NS_MAIN + "si"
+
+# Shared string cells in the raw sheet XML (index captured)
+_SHARED_STRING_CELL = re.compile(rb'<c\b[^>]*\bt="s"[^>]*>\s*<v>(\d+)</v>')
+
+# Column letters to 0-based index, filled on the fly
+_column_indexes = {}
+
+
+class UnsupportedWorkbookError(ValueError):
+    """Raised when the archive structure is not handled by this engine.
+    The openpyxl engine should be used instead. """
+
+
+def _column_index(coordinate):
+    """Convert a cell coordinate ("AB12") to a 0-based column index. """
+    letters = coordinate.rstrip("0123456789")
+    try:
+        return _column_indexes[letters]
+    except KeyError:
+        col_i = column_index_from_string(letters) - 1
+        _column_indexes[letters] = col_i
+        return col_i
+
+
+def _text_content(node):
+    """Text of a string node (shared or inline), formatting removed. """
+    snippets = []
+    plain = node.find(_TEXT_TAG)
+    if plain is not None and plain.text is not None:
+        snippets.append(plain.text)
+    for run in node.iterfind(_RUN_TAG):
+        text = run.findtext(_TEXT_TAG)
+        if text is not None:
+            snippets.append(text)
+    return "".join(snippets)
+
+
+def _cast_number(value):
+    """Convert a number stored as a string to an int or a float
+    (same rule as openpyxl). """
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+class _RowBuffer:
+    """Values of a worksheet row, stored by 0-based column index.
+
+    Cells before "split" (names and units) are kept as is in a dict.
+    The following cells (values) are stored in a NumPy buffer
+    preallocated for the row width : float64 when all the values are
+    numbers (NaN for empty cells), object otherwise.
+    """
+
+    def __init__(self, cells, split):
+        """Creation of a row buffer.
+
+        Parameters
+        ----------
+        cells : list of tupples (int column index, value)
+            Not-empty cells of the row, sorted by column.
+        split : int
+            Index of the first column stored in the buffer.
+        """
+        self.first_col_i = cells[0][0]
+        self.last_col_i = cells[-1][0]
+        self.split = split
+        self.head = {}
+        positions = []
+        values = []
+        for (col_i, value) in cells:
+            if col_i < split:
+                self.head[col_i] = value
+            else:
+                positions.append(col_i - split)
+                values.append(value)
+        self.int_mask = None
+        width = max(self.last_col_i + 1 - split, 0)
+        types = set(map(type, values))
+        if values and types <= {int, float}:
+            self.buffer = np.full(width, np.nan)
+            self.buffer[positions] = values
+            self.ints = types == {int}
+            if len(types) > 1:
+                self.int_mask = np.zeros(width, dtype=bool)
+                self.int_mask[positions] = [type(v) is int for v in values]
+        else:
+            self.buffer = np.full(width, None, dtype=object)
+            self.buffer[positions] = values
+            self.ints = False
+
+    @property
+    def numeric(self):
+        """True if the buffer only contains numbers. """
+        return self.buffer.dtype != object
+
+    def value(self, col_i):
+        """Value of the cell at the given column (None if empty). """
+        if col_i < self.split:
+            return self.head.get(col_i)
+        buf_i = col_i - self.split
+        if buf_i >= len(self.buffer):
+            return None
+        value = self.buffer[buf_i]
+        if not self.numeric:
+            return value
+        if np.isnan(value):
+            return None
+        if self.ints or (self.int_mask is not None and self.int_mask[buf_i]):
+            return int(value)
+        return float(value)
+
+    def values(self, first_col_i, last_col_i):
+        """Values of the cells between two columns (included), as
+        a typed NumPy array or as a list for pandas type inference. """
+        n_vals = last_col_i + 1 - first_col_i
+        if first_col_i >= self.split and self.numeric:
+            start = first_col_i - self.split
+            vals = self.buffer[start:start+n_vals]
+            if len(vals) < n_vals:
+                vals = np.concatenate([vals,
+                                       np.full(n_vals - len(vals), np.nan)])
+            missing = np.isnan(vals)
+            if missing.all():
+                return [None] * n_vals
+            if self.ints and not missing.any():
+                return vals.astype(np.int64)
+            return vals
+        return [self.value(c) for c in range(first_col_i, last_col_i + 1)]
+
+    def filled_values(self):
+        """Not-empty values of the row, from left to right. """
+        vals = (self.value(c)
+                for c in range(self.first_col_i, self.last_col_i + 1))
+        return [v for v in vals if v is not None]
+
+
+class StreamWorksheet:
+    """Worksheet of a StreamWorkbook.
+
+    The sheet XML part is read with an incremental parser, without
+    any openpyxl cell object.
+
+    Attributes
+    ----------
+    title : string
+        Worksheet name.
+    """
+
+    def __init__(self, workbook, title, path):
+        self._workbook = workbook
+        self.title = title
+        self._path = path
+
+    def _iter_cells(self):
+        """Yield (0-based row index, list of (column index, value)) for
+        each row stored in the sheet XML. """
+        cell_value = self._workbook.cell_value
+        date_styles = self._workbook.date_style_refs
+        with self._workbook.archive.open(self._path) as source:
+            row_i = -1
+            # Only "end" events : a row element is complete when seen
+            for _, elem in ET.iterparse(source):
+                if elem.tag != _ROW_TAG:
+                    continue
+                row_ref = elem.get('r')
+                row_i = int(row_ref) - 1 if row_ref else row_i + 1
+                n_digits = -len(row_ref) if row_ref else None
+                cells = []
+                col_i = -1
+                for c in elem:
+                    coordinate = c.get('r')
+                    if coordinate:
+                        letters = coordinate[:n_digits]
+                        try:
+                            col_i = _column_indexes[letters]
+                        except KeyError:
+                            col_i = _column_index(coordinate)
+                    else:
+                        col_i += 1
+                    # Fast path for plain numbers (most of the cells)
+                    if (c.get('t') is None and
+                            c.get('s') not in date_styles):
+                        value = c.findtext(_VALUE_TAG)
+                        if not value:
+                            continue
+                        if "." in value or "E" in value or "e" in value:
+                            value = float(value)
+                        else:
+                            value = int(value)
+                    else:
+                        value = cell_value(c)
+                    if value is not None:
+                        cells.append((col_i, value))
+                yield row_i, cells
+                # Rows are wide (one cell per point) but not numerous :
+                # only the cleared row elements are kept by the parser
+                elem.clear()
+
+    def fingerprint(self):
+        """Hash of the worksheet content, computed without parsing the
+        sheet XML : title, raw bytes of the XML part, shared strings
+        used by the sheet (in order of use) and date styles. Two sheets
+        with the same fingerprint give the same dataframe. """
+        wb = self._workbook
+        content = wb.archive.read(self._path)
+        sheet_hash = hashlib.blake2b(self.title.encode('utf-8'),
+                                     digest_size=20)
+        sheet_hash.update(b'\0')
+        sheet_hash.update(content)
+        sheet_hash.update(wb.styles_signature)
+        indexes = _SHARED_STRING_CELL.findall(content)
+        if len(indexes) == content.count(b't="s"'):
+            for index in indexes:
+                sheet_hash.update(wb.shared_strings[int(index)]
+                                  .encode('utf-8'))
+                sheet_hash.update(b'\0')
+        else:
+            # Unexpected cell markup : the whole table is used
+            sheet_hash.update(wb.shared_strings_hash)
+        return sheet_hash.hexdigest()
+
+    def to_dataframe(self):
+        """
+        Store the data of the worksheet in a pandas.DataFrame.
+        Same layout rules and same output as
+        "xlsx.rows_to_dataframe".
+
+        Returns
+        -------
+        dataframe : pandas.DataFrame
+            Dataframe containing the data of the worksheet.
+        comments : string
+            Comments found before the data.
+        """
+
+        # Same block logic as xlsx.rows_to_dataframe, None standing for
+        # an empty row (rows absent from the XML are empty rows)
+        comment_block = None
+        block = []
+        block_len = 0
+        first_col_i = last_col_i = None
+        next_row_i = 0
+        for (row_i, cells) in self._iter_cells():
+            n_empty = row_i - next_row_i + (0 if cells else 1)
+            next_row_i = row_i + 1
+            if n_empty > 0 and block:
+                if comment_block is None:
+                    comment_block = (block, first_col_i, last_col_i)
+                    block = []
+                    block_len = 0
+                    first_col_i = last_col_i = None
+                else:
+                    block.extend([None] * n_empty)
+            if not cells:
+                continue
+            if first_col_i is None:
+                split = cells[0][0] + 2
+            else:
+                split = min(first_col_i, cells[0][0]) + 2
+            row = _RowBuffer(cells, split)
+            block.append(row)
+            block_len = len(block)
+            if first_col_i is None:
+                (first_col_i, last_col_i) = (row.first_col_i, row.last_col_i)
+            else:
+                first_col_i = min(first_col_i, row.first_col_i)
+                last_col_i = max(last_col_i, row.last_col_i)
+
+        # No data after the first block : it is the data itself
+        if not block:
+            if comment_block is None:
+                raise ValueError("Empty worksheet : no data found")
+            (block, first_col_i, last_col_i) = comment_block
+            block_len = len(block)
+            comment_block = None
+        data_rows = block[:block_len]
+
+        # comments stored as a string
+        if comment_block is None:
+            comments = ""
+        else:
+            comments = "\n".join(" ".join(str(v) for v in row.filled_values())
+                                 for row in comment_block[0])
+
+        # Names, units and one values column per data row
+        n_points = max(last_col_i - first_col_i - 1, 0)
+        libs = [row.value(first_col_i) if row else None for row in data_rows]
+        units = [row.value(first_col_i+1) if row else None
+                 for row in data_rows]
+        columns = {}
+        for (i, row) in enumerate(data_rows):
+            if row is None or n_points == 0:
+                columns[i] = [None] * n_points
+            else:
+                columns[i] = row.values(first_col_i + 2, last_col_i)
+
+        # Defining indexes and column names as tuples, and converting them
+        # to multi-indexes
+        index_tuples = [(self.title, str(pt)) for pt in range(1,n_points+1)]
+        multi_index = pd.MultiIndex.from_tuples(index_tuples)
+        column_tuples = [*zip(libs, units)]
+        multi_column = pd.MultiIndex.from_tuples(column_tuples)
+
+        # Pandas Dataframe creation and return
+        dataframe = pd.DataFrame(data=columns, index=multi_index)
+        dataframe.columns = multi_column
+        return dataframe, comments
+
+
+class StreamWorkbook:
+    """Excel workbook read straight from its zip archive.
+
+    Only the parts needed to get the cell values are read : workbook
+    (sheet names and epoch), relationships, shared strings and styles
+    (date formats).
+
+    Attributes
+    ----------
+    archive : zipfile.ZipFile
+        Opened workbook archive.
+    worksheets : list of StreamWorksheet
+        Worksheets, in the workbook order.
+    shared_strings : list of strings
+        Shared strings table.
+    styles_signature : bytes
+        Epoch and date styles, which change the cell values.
+    """
+
+    def __init__(self, filepath):
+        """Open a workbook given as a path or as a file object. """
+        try:
+            self.archive = zipfile.ZipFile(filepath)
+        except zipfile.BadZipFile as e:
+            raise UnsupportedWorkbookError(str(e))
+        try:
+            self._read_structure()
+        except (KeyError, AttributeError) as e:
+            self.archive.close()
+            raise UnsupportedWorkbookError("Unexpected workbook structure : "
+                                           + str(e))
+
+    def close(self):
+        """Close the archive. """
+        self.archive.close()
+
+    def _read_rels(self, part_path):
+        """Dict of relationship ID : (type, target path) of a part. """
+        folder, name = posixpath.split(part_path)
+        rels_path = posixpath.join(folder, "_rels", name + ".rels")
+        rels = {}
+        root = ET.fromstring(self.archive.read(rels_path))
+        for rel in root.iter(_NS_PKG + "Relationship"):
+            target = rel.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(folder, target))
+            rels[rel.get('Id')] = (rel.get('Type'), target)
+        return rels
+
+    def _read_structure(self):
+        """Read the workbook parts common to all the sheets. """
+        wb_path = [target for (rel_type, target)
+                   in self._read_rels("").values()
+                   if rel_type.endswith("/officeDocument")][0]
+        wb_rels = self._read_rels(wb_path)
+        wb_root = ET.fromstring(self.archive.read(wb_path))
+        if wb_root.tag != _NS_MAIN + "workbook":
+            raise UnsupportedWorkbookError("Unknown workbook namespace")
+
+        # Dates epoch
+        wb_pr = wb_root.find(_NS_MAIN + "workbookPr")
+        date1904 = wb_pr is not None and wb_pr.get('date1904') in ('1', 'true')
+        self._epoch = MAC_EPOCH if date1904 else WINDOWS_EPOCH
+
+        # Worksheets (chartsheets are ignored, as in openpyxl)
+        self.worksheets = []
+        for sheet in wb_root.iter(_NS_MAIN + "sheet"):
+            (rel_type, path) = wb_rels[sheet.get(_NS_REL + "id")]
+            if rel_type.endswith("/worksheet"):
+                self.worksheets.append(StreamWorksheet(self,
+                                                       sheet.get('name'),
+                                                       path))
+
+        # Shared strings and styles
+        self.shared_strings = []
+        self._date_styles = set()
+        self.date_style_refs = set() # style IDs as written in the XML
+        self._timedelta_styles = set()
+        for (rel_type, path) in wb_rels.values():
+            if rel_type.endswith("/sharedStrings"):
+                self._read_shared_strings(path)
+            elif rel_type.endswith("/styles"):
+                self._read_styles(path)
+        self.styles_signature = repr((self._epoch,
+                                      sorted(self._date_styles),
+                                      sorted(self._timedelta_styles))
+                                     ).encode('utf-8')
+
+    @property
+    def shared_strings_hash(self):
+        """Hash of the whole shared strings table. """
+        table_hash = hashlib.blake2b(digest_size=20)
+        for text in self.shared_strings:
+            table_hash.update(text.encode('utf-8'))
+            table_hash.update(b'\0')
+        return table_hash.digest()
+
+    def _read_shared_strings(self, path):
+        """Load the shared strings table. """
+        with self.archive.open(path) as source:
+            for _, node in ET.iterparse(source):
+                if node.tag == _STRING_TAG:
+                    text = _text_content(node).replace('x005F_', '')
+                    self.shared_strings.append(text)
+                    node.clear()
+
+    def _read_styles(self, path):
+        """Index the cell styles corresponding to dates or durations. """
+        root = ET.fromstring(self.archive.read(path))
+        custom = {int(fmt.get('numFmtId')): fmt.get('formatCode')
+                  for fmt in root.iter(_NS_MAIN + "numFmt")}
+        cell_xfs = root.find(_NS_MAIN + "cellXfs")
+        if cell_xfs is None:
+            return
+        for (style_id, xf) in enumerate(cell_xfs.iterfind(_NS_MAIN + "xf")):
+            fmt_id = int(xf.get('numFmtId', 0))
+            fmt = custom.get(fmt_id, builtin_format_code(fmt_id))
+            if fmt is None:
+                continue
+            if is_date_format(fmt):
+                self._date_styles.add(style_id)
+                self.date_style_refs.add(str(style_id))
+            if is_timedelta_format(fmt):
+                self._timedelta_styles.add(style_id)
+
+    def cell_value(self, c):
+        """Python value of a cell XML element (cached value for
+        formulas, as openpyxl with "data_only=True"). """
+        data_type = c.get('t', 'n')
+        if data_type == 'inlineStr':
+            child = c.find(_INLINE_TAG)
+            return None if child is None else _text_content(child)
+        value = c.findtext(_VALUE_TAG) or None
+        if value is None:
+            return None
+        if data_type == 'n':
+            value = _cast_number(value)
+            style_id = c.get('s')
+            if style_id and int(style_id) in self._date_styles:
+                style_id = int(style_id)
+                try:
+                    value = from_excel(value, self._epoch,
+                        timedelta=style_id in self._timedelta_styles)
+                except (OverflowError, ValueError):
+                    value = "#VALUE!"
+        elif data_type == 's':
+            value = self.shared_strings[int(value)]
+        elif data_type == 'b':
+            value = bool(int(value))
+        elif data_type == 'd':
+            value = from_ISO8601(value)
+        return value
+
+
+def sheet_differences(sheet, other):
+    """Differences between two parsed sheets (tupples (title, dataframe,
+    comments)) : list of str, empty if the sheets are the same. """
+    (title, df, comments) = sheet
+    (other_title, other_df, other_comments) = other
+    checks = [("title", title == other_title),
+              ("columns", df.columns.equals(other_df.columns)),
+              ("index", df.index.equals(other_df.index)),
+              ("dtypes", list(df.dtypes) == list(other_df.dtypes)),
+              ("values", df.equals(other_df)),
+              ("comments", comments == other_comments)]
+    return [name for (name, same) in checks if not same]
+
+
+def compare_engines(filepath):
+    """Compare the sheets of a workbook read by the openpyxl engine and
+    by the stream engine (without fallback to openpyxl). Return a list
+    of tupples (sheet title, list of differences) for each sheet. """
+    from . import xlsx
+    # Raises UnsupportedWorkbookError instead of falling back
+    StreamWorkbook(filepath).close()
+    reference = xlsx.read_sheets(filepath, engine='openpyxl')
+    streamed = xlsx.read_sheets(filepath, engine='stream')
+    if len(reference) != len(streamed):
+        return [(None, ["number of sheets"])]
+    return [(sheet[0], sheet_differences(sheet, other))
+            for (sheet, other) in zip(reference, streamed)]
+
+
+def main():
+    # Both engines checked against the test workbooks, sheet by sheet :
+    # exit status 1 on a difference
+    # (to run as a module : python -m core.read_data.xlsx_stream)
+    import glob
+    import os
+    import sys
+    data_dir = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+    filepaths = sorted(glob.glob(os.path.join(data_dir, "*.xlsx")))
+    if not filepaths:
+        print("No workbook in", data_dir)
+        sys.exit(1)
+    failed = False
+    for filepath in filepaths:
+        try:
+            results = compare_engines(filepath)
+        except Exception as e:
+            results = [(None, [repr(e)])]
+        for (title, differences) in results:
+            print(os.path.basename(filepath), title,
+                  "OK" if not differences
+                  else "DIFFERENT : " + ", ".join(differences))
+            failed = failed or bool(differences)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
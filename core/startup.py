@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import os
+import sys
+import time
+import socket
+import importlib
+import subprocess
+import urllib.request
+
+
+# Time to the first response of the server started without data, in
+# seconds (checked by the benchmark of "main")
+STARTUP_TARGET = 1.0
+
+
+class _TimedLoader:
+    """Loader of a module executing it through the real loader, timed
+    by an ImportTimer. """
+
+    def __init__(self, loader, timer, name):
+        self._loader = loader
+        self._timer = timer
+        self._name = name
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # The module only sees its real loader
+        module.__loader__ = self._loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+        self._timer._timed(self._name, self._loader.exec_module, module)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class ImportTimer:
+    """Import times of the modules, as "python -X importtime" : time
+    spent in each module (self) and with the modules it imports
+    (cumulative), in microseconds.
+
+    Installed as the first finder of "sys.meta_path" : the modules are
+    still found and loaded by the other finders, only their execution
+    is timed.
+
+    Attributes
+    ----------
+    records : list of tupples
+        (module name, self time, cumulative time, import depth), in
+        the order the imports end.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._children = [] # time of the imports nested in each level
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self, name)
+        return spec
+
+    def _timed(self, name, function, module):
+        self._children.append(0)
+        start = time.perf_counter_ns()
+        try:
+            function(module)
+        finally:
+            cumulative = (time.perf_counter_ns() - start) // 1000
+            nested = self._children.pop()
+            if self._children:
+                self._children[-1] += cumulative
+            self.records.append((name, cumulative - nested, cumulative,
+                                 len(self._children)))
+
+    def report(self, limit=20):
+        """Report of the "limit" slowest imports (cumulative time) and
+        of the total time of the top level imports. """
+        total = sum(cumulative for (name, own, cumulative, depth)
+                    in self.records if depth == 0)
+        slowest = sorted(self.records, key=lambda record: -record[2])
+        lines = ["import time: self [us] | cumulative | imported package"]
+        for (name, own, cumulative, depth) in slowest[:limit]:
+            lines.append("import time: {0:9d} | {1:10d} | {2}{3}".format(
+                own, cumulative, "  " * depth, name))
+        lines.append("{0} modules imported in {1:.0f} ms".format(
+            len(self.records), total / 1000))
+        return "\n".join(lines)
+
+
+def preload(modules):
+    """Import modules deferred to their first use (e.g. before forking
+    workers, which then share them). """
+    for module in modules:
+        importlib.import_module(module)
+
+
+def free_port():
+    """Number of a TCP port free on this host (chosen by the system). """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(command, url, timeout=60.):
+    """Start a server ("command", list of arguments) and measure the
+    time until "url" answers, in seconds (None if it does not answer
+    within "timeout"). The server is stopped afterwards. """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                return None
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    response.read()
+                return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    timer = ImportTimer()
+    timer.install()
+    import gui.dashgui
+    import core.datamanagement
+    timer.uninstall()
+    print(timer.report(10))
+
+    # Startup benchmark : server without data, on a free port
+    script = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), "PysyPlot.py")
+    times = []
+    for run_i in range(3):
+        port = str(free_port())
+        times.append(time_to_first_response(
+            [sys.executable, script, '--port', port],
+            "http://127.0.0.1:" + port + "/"))
+    if None in times:
+        print("Server not started")
+        sys.exit(1)
+    best = min(times)
+    print("Time to first response : {0:.2f} s (best of {1}), target "
+          "{2:.1f} s : {3}".format(best, len(times), STARTUP_TARGET,
+                                   "OK" if best <= STARTUP_TARGET
+                                   else "too slow"))
+    # Non-zero exit status, for a use as a regression check
+    if best > STARTUP_TARGET:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
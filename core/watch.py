@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import os
+import threading
+
+
+class FolderWatcher:
+    """Server-side ingestion of the workbooks dropped in a folder.
+
+    A background thread polls the folder. New or changed ".xlsx" files
+    are detected by their modification time and size, and parsed into
+    the data manager once their size is stable (file completely
+    written). The most recent workbook is the one loaded. The GUI
+    polls "status" to know when a new dataset is published. With a
+    "sequence" file, each publication is also broadcast to the other
+    processes of the server (see WatchBroadcast).
+
+    Attributes
+    ----------
+    directory : string
+        Watched folder.
+    period : float
+        Polling period, in seconds.
+    """
+
+    def __init__(self, dm, directory, period=2.0, sequence=None):
+        """Creation of a watcher (not started).
+
+        Parameters
+        ----------
+        dm : DataManager
+            Data manager in which the workbooks are loaded.
+        directory : string
+            Folder to watch.
+        period : float
+            Polling period, in seconds. The default is 2.
+        sequence : SequenceFile
+            File in which the publications are broadcast. The default
+            is None (no broadcast).
+        """
+        self._dm = dm
+        self._sequence = sequence
+        self.directory = directory
+        self.period = period
+        self._seen = None # path : (mtime, size) of the files processed
+        self._pending = {} # path : (mtime, size) waiting to be stable
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._status = (0, None, None, None)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def dm(self):
+        """Data manager in which the workbooks are loaded (the pages
+        use its dataset through its content key). """
+        return self._dm
+
+    @property
+    def status(self):
+        """Tupple (version, file name, last modification timestamp,
+        error message). The version is incremented each time a
+        workbook is published (0 : nothing loaded yet). """
+        with self._lock:
+            return self._status
+
+    def start(self):
+        """Start the polling thread. """
+        self._thread.start()
+
+    def stop(self):
+        """Stop the polling thread. """
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except OSError as e:
+                print(e)
+            self._stop.wait(self.period)
+
+    def _scan(self):
+        """Dict of path : (mtime, size) of the workbooks of the folder
+        (Excel lock files excluded). """
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if (entry.name.lower().endswith('.xlsx') and
+                        not entry.name.startswith('~$') and
+                        entry.is_file()):
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def poll(self):
+        """Check the folder once and load the most recent new or
+        changed workbook. Return True if a workbook was published. """
+        files = self._scan()
+
+        # Files already present at start are considered complete
+        if self._seen is None:
+            self._seen = {}
+            self._pending = dict(files)
+
+        # A file is processed when unchanged since the previous poll
+        ready = []
+        for (path, stat) in files.items():
+            if self._seen.get(path) == stat:
+                continue
+            if self._pending.get(path) == stat:
+                ready.append((stat[0], path))
+            else:
+                self._pending[path] = stat
+        if not ready:
+            return False
+        for (mtime, path) in ready:
+            self._seen[path] = self._pending.pop(path)
+
+        # Only the most recent workbook is loaded
+        (mtime, path) = max(ready)
+        try:
+            self._dm.readxlsx(path)
+            error = None
+        except Exception as e:
+            print(e)
+            error = str(e)
+        with self._lock:
+            version = self._status[0] + 1
+            self._status = (version, os.path.basename(path), mtime, error)
+        if self._sequence is not None:
+            self._sequence.publish({'name': os.path.basename(path),
+                                    'mtime': mtime,
+                                    'error': error,
+                                    'key': self._dm.content_key})
+        return True
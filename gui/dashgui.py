@@ -2,21 +2,29 @@
 # coding: utf-8
 
 import io
+import uuid
+import logging
 import base64
 import datetime as dt
 
+import numpy as np
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State, MATCH, ALL
 
+from core.figurecache import FigureCache
+from core.payload import encode_arrays, payload_metrics
+
+logger = logging.getLogger(__name__)
 
 
 #####################################
 ############ Main layout ############
 #####################################
 
-def set_app_layout(dm):   
+def set_app_layout(watcher=None):   
     
     app = dash.Dash(__name__)
     
@@ -29,8 +37,10 @@ def set_app_layout(dm):
         ),
         
         # Upload anf filters definition
-        def_upload(),
-        def_div_subsets(dm),
+        def_page_state(),
+        def_upload(watcher),
+        def_watch(watcher),
+        def_div_subsets(),
         def_div_graphs()
     ])    
     
@@ -42,13 +52,44 @@ def set_app_layout(dm):
 ####################################
 
 
-def def_upload():
+def def_page_state():
+    # State of the page, sent with the requests (no session on the
+    # server) : content key of the dataset and subsets definitions,
+    # and the upload parsed in the background (job polled)
+    div = html.Div(
+        children=[
+            dcc.Store(
+                id='dataset_key'
+            ),
+            dcc.Store(
+                id='subsets_store',
+                data={}
+            ),
+            dcc.Store(
+                id='load_job'
+            ),
+            dcc.Interval(
+                id='load_interval',
+                interval=500,
+                disabled=True
+            )
+        ]
+    )
+    return div
+
+
+def def_upload(watcher=None):
+    if watcher is None:
+        ul_txt_1 = 'Drag and drop or click to select a single file to upload.'
+    else:
+        ul_txt_1 = 'Watching folder ' + watcher.directory + \
+                   ' (or drag and drop a small file).'
     upload = dcc.Upload(
         className='upload',
         id='upload',
         children=[
             html.Div(id = 'ul_txt_1', children =
-                ['Drag and drop or click to select a single file to upload.']
+                [ul_txt_1]
             ),
             html.Div(id = 'ul_txt_2', children =
                 ['--- No file selected. ---']
@@ -59,7 +100,26 @@ def def_upload():
     return upload
 
 
-def def_div_subsets(dm):
+def def_watch(watcher=None):
+    # Polling of the watched folder (disabled without watcher), and
+    # version of the last workbook published to this page
+    div = html.Div(
+        children=[
+            dcc.Interval(
+                id='watch_interval',
+                interval=2000,
+                disabled=watcher is None
+            ),
+            dcc.Store(
+                id='watch_version',
+                data=0
+            )
+        ]
+    )
+    return div
+
+
+def def_div_subsets():
        
     div = html.Div(
         id='subsets',
@@ -145,6 +205,22 @@ def def_div_graphs():
                 className='one-half column',
                 children='Add parallel coordinates plot'
             ),
+            # Refresh of all the graphs in one pass (background job)
+            html.Button(
+                id='plot_all_button',
+                children='Plot all'
+            ),
+            html.Div(
+                id='plot_all_progress'
+            ),
+            dcc.Store(
+                id='plot_all_job'
+            ),
+            dcc.Interval(
+                id='plot_all_interval',
+                interval=500,
+                disabled=True
+            ),
             html.Div(
                 id='graphs_container',
                 children=[]
@@ -198,6 +274,22 @@ def def_div_scatter_plot(id_index, dm):
                         options=var_options,
                         placeholder="Z-axis variable (optionnal)"
                     ),
+                    dcc.Dropdown(
+                        id={'type': 'render_dropdown',
+                            'index': id_index},
+                        options=[
+                            {'value': 'auto',
+                             'label': 'Rendering : automatic'},
+                            {'value': 'svg',
+                             'label': 'Rendering : SVG (all points)'},
+                            {'value': 'webgl',
+                             'label': 'Rendering : WebGL (all points)'},
+                            {'value': 'density',
+                             'label': 'Rendering : density (binned)'}
+                        ],
+                        value='auto',
+                        clearable=False
+                    ),
                     html.Button(
                         id={'type': 'graph_plot_scatter_button',
                             'index': id_index},
@@ -213,7 +305,8 @@ def def_div_scatter_plot(id_index, dm):
             html.Div(
                 id={'type': 'graph_scatter_div_right',
                     'index': id_index},
-                className='flex-item-50pct'
+                className='flex-item-50pct',
+                children=def_graph_output('scatter', id_index)
             )
         ]
     )
@@ -269,19 +362,430 @@ def def_div_par_coor_plot(id_index, dm):
             html.Div(
                 id={'type': 'graph_parcoor_scatter_div_right',
                     'index': id_index},
-                className='flex-item-50pct'
+                className='flex-item-50pct',
+                children=def_graph_output('parcoor', id_index)
             )
         ]
     )
     return div
 
+def def_graph_output(graph_type, id_index):
+    # Graph kept for the whole life of the panel : the plot callbacks
+    # only send the changes of the figure ("delta" store), applied to
+    # the displayed figure in the browser
+    return [
+        dcc.Graph(
+            id={'type': graph_type + '_graph',
+                'index': id_index},
+            style={'display': 'none'}
+        ),
+        dcc.Store(
+            id={'type': graph_type + '_delta',
+                'index': id_index}
+        ),
+        # Parameters of the plot (dataset, subsets, variables), for the
+        # zoom refinements
+        dcc.Store(
+            id={'type': graph_type + '_spec',
+                'index': id_index}
+        ),
+        # Figure built in the background : job polled, with its progress
+        html.Div(
+            id={'type': graph_type + '_progress',
+                'index': id_index}
+        ),
+        dcc.Store(
+            id={'type': graph_type + '_job',
+                'index': id_index}
+        ),
+        dcc.Interval(
+            id={'type': graph_type + '_interval',
+                'index': id_index},
+            interval=500,
+            disabled=True
+        ),
+        # Figure of the panel in a batch ("Plot all" button)
+        dcc.Store(
+            id={'type': graph_type + '_batch',
+                'index': id_index}
+        )
+    ]
+
+
+####################################
+########## Figure updates ##########
+####################################
+
+# Client side application of a figure delta (see "figure_delta")
+APPLY_FIGURE_DELTA = """
+function(delta, figure) {
+    if (!delta) {
+        return [window.dash_clientside.no_update,
+                window.dash_clientside.no_update];
+    }
+    function patch(obj, changes) {
+        var patched = Object.assign({}, obj || {});
+        for (var key in changes) {
+            if (changes[key] === null) {
+                delete patched[key];
+            } else {
+                patched[key] = changes[key];
+            }
+        }
+        return patched;
+    }
+    var newFigure;
+    if (delta.full) {
+        newFigure = delta.full;
+    } else {
+        figure = figure || {};
+        var data = (figure.data || []).slice(0, delta.n_traces);
+        for (var i in delta.traces) {
+            data[i] = patch(data[i], delta.traces[i]);
+        }
+        newFigure = {data: data,
+                     layout: patch(figure.layout, delta.layout)};
+    }
+    return [newFigure, {display: 'block'}];
+}
+"""
+
+
+def _same_value(old, new):
+    """Equality of two figure properties (arrays included). """
+    if isinstance(old, np.ndarray) or isinstance(new, np.ndarray):
+        try:
+            return np.array_equal(np.asarray(old), np.asarray(new))
+        except Exception:
+            return False
+    if isinstance(old, dict) and isinstance(new, dict):
+        return old.keys() == new.keys() and all(_same_value(old[k], new[k])
+                                                for k in old)
+    if isinstance(old, (list, tuple)) and isinstance(new, (list, tuple)):
+        return len(old) == len(new) and all(_same_value(o, n)
+                                            for (o, n) in zip(old, new))
+    try:
+        return bool(old == new)
+    except Exception:
+        return False
+
+
+def _changed_properties(old, new):
+    """Properties (first level keys) of "new" which are different in
+    "old", and None for the properties removed. """
+    changes = {key: value for (key, value) in new.items()
+               if key not in old or not _same_value(old[key], value)}
+    changes.update({key: None for key in old if key not in new})
+    return changes
+
+
+def figure_delta(old_figure, new_figure):
+    """Changes to apply to a displayed figure to obtain a new one.
+
+    Returns a dict : {'full': figure} if there is no displayed figure,
+    else {'n_traces': number of traces, 'traces': {trace index :
+    changed properties}, 'layout': changed layout properties} (only
+    the changed properties, such as "x"/"y" arrays or marker colours,
+    are sent; traces beyond "n_traces" are removed).
+    """
+    new = new_figure.to_plotly_json()
+    if old_figure is None:
+        return {'full': new}
+    old = old_figure.to_plotly_json()
+    (old_data, new_data) = (old.get('data', []), new.get('data', []))
+    traces = {}
+    for (trace_i, trace) in enumerate(new_data):
+        if trace_i < len(old_data):
+            changes = _changed_properties(old_data[trace_i], trace)
+        else:
+            changes = trace
+        if changes:
+            traces[trace_i] = changes
+    return {'n_traces': len(new_data),
+            'traces': traces,
+            'layout': _changed_properties(old.get('layout', {}),
+                                          new.get('layout', {}))}
+
+
 ####################################
 ############ Callbacks ############
 ####################################
 
-def callbacks(app, dm):
+def relayout_ranges(relayout):
+    """Axes windows (x_range, y_range) of a graph "relayoutData" event
+    (None for an autoscale), or None if the event is not a zoom. """
+    ranges = []
+    zoom = False
+    for axis in ('xaxis', 'yaxis'):
+        if axis + '.range[0]' in relayout:
+            ranges.append([relayout[axis + '.range[0]'],
+                           relayout[axis + '.range[1]']])
+            zoom = True
+        elif axis + '.range' in relayout:
+            ranges.append(relayout[axis + '.range'])
+            zoom = True
+        else:
+            if relayout.get(axis + '.autorange'):
+                zoom = True
+            ranges.append(None)
+    if not zoom:
+        return None
+    return tuple(ranges)
+
+
+# Time a callback waits for its job before letting the page poll it
+JOB_WAIT = 0.3
+
+
+def progress_text(status):
+    """Description of the progress of a running job (see JobQueue). """
+    if status['state'] == 'queued' or status['done'] is None:
+        return "Waiting..."
+    if status['total'] is None:
+        return status['text'] or "Running..."
+    return "{0} / {1} {2}".format(status['done'], status['total'],
+                                  status['text']).strip()
+
+
+def load_job(job, datasets, file, previous_key):
+    """Job parsing an uploaded workbook : content key of its dataset. """
+    def progress(done, total):
+        job.progress(done, total, "sheets parsed")
+    job.progress(0, None, "opening the workbook")
+    return datasets.load(file, previous_key, progress).content_key
+
+
+def batch_job(job, dm, plots):
+    """Job building the figures of several plots in one pass (see
+    DataManager.plot_batch). """
+    return dm.plot_batch(plots, progress=job.progress)
+
+
+def subset_tuples(dm, subsets):
+    """Tupples (var, operator, criterion) of subsets definitions of a
+    page (dicts with the variable as a list, the operator as
+    displayed and the criterion). """
+    opers = {o['disp'] : o['op'] for o in dm.df_ops}
+    return [(tuple(ss['var']), opers[ss['oper']], ss['crit'])
+            for ss in subsets]
+
+
+def callbacks(app, datasets, jobs, watcher=None, binary=False,
+              float32=False, metrics=False):
+    """Definition of the callbacks of the application.
+    The callbacks are stateless : the page keeps the content key of its
+    dataset, its subsets and the parameters of its plots (stores), sent
+    with the requests. The data manager of the dataset is taken from
+    "datasets" (DatasetStore), in any process of the server.
+    Uploads and plots run as background jobs of "jobs" (JobQueue) : a
+    job not done within JOB_WAIT seconds is polled by the page, which
+    displays its progress; a newer request of the same component
+    cancels the previous job. The jobs are kept in the page as dicts
+    {'id': job id, 'item': None, or position of the figure of a panel
+    in the result of a batch}.
+    With "binary", numeric arrays of the figures are sent as base64
+    typed arrays (in simple precision with "float32", where precision
+    allows), whatever the Plotly version (Plotly 6 and above already
+    encodes the arrays it validates). They are decoded by plotly.js
+    2.28 and above only : the plotly.js bundled with
+    dash-core-components 1.x is older, hence JSON lists by default.
+    With "metrics", the payload size and serialization time of each
+    figure update are logged (serialized once more to measure them). """
+
+    # Figures displayed in the graphs, by token (kept in the delta
+    # stores), to compute the changes of the next plot
+    displayed_figures = FigureCache()
+
+    def figure_update(figure, previous_delta):
+        """Delta store data to display a figure in place of the one
+        displayed (token of the previous delta). """
+        previous = None
+        if previous_delta is not None:
+            previous = displayed_figures.get(previous_delta['token'])
+        delta = figure_delta(previous, figure)
+        if binary:
+            delta = encode_arrays(delta, float32)
+        delta['token'] = uuid.uuid4().hex
+        displayed_figures.put(delta['token'], figure)
+        if metrics:
+            measures = payload_metrics(delta)
+            logger.info("Figure update : %.1f kB, serialized in %.1f ms",
+                        measures['size'] / 1000,
+                        1000 * measures['serialize_time'])
+        return delta
 
-    # Load a file
+    def data_manager(dataset_key):
+        """Data manager of the dataset of a page (no update if the
+        dataset is not available anymore). """
+        dm = datasets.get(dataset_key)
+        if dm is None:
+            raise dash.exceptions.PreventUpdate
+        return dm
+
+    def plot_spec(dataset_key, subsets, subset_ids, **variables):
+        """Parameters of a plot (dict stored in the panel) : dataset
+        key, definitions of the selected subsets and variables. """
+        if subset_ids is None:
+            subset_ids = []
+        spec = {'dataset': dataset_key,
+                'subsets': [subsets[ss_id] for ss_id in subset_ids
+                            if ss_id in subsets]}
+        spec.update(variables)
+        return spec
+
+    def scatter_figure(dm, spec, x_range=None, y_range=None,
+                       progress=None):
+        """Figure of a scatter plot from its parameters (see
+        "plot_spec"), for an optional zoomed window. """
+        var_x = dm.df_vars[spec['var_x']]
+        var_y = dm.df_vars[spec['var_y']]
+        if spec['var_z'] is None:
+            var_z = None
+        else:
+            var_z = dm.df_vars[spec['var_z']]
+        return dm.plot_scatter(subset_tuples(dm, spec['subsets']),
+                               var_x, var_y, var_z,
+                               spec['render'], x_range, y_range,
+                               progress=progress)
+
+    def parcoor_figure(dm, spec, progress=None):
+        """Figure of a parallel coordinates plot from its parameters
+        (see "plot_spec"). """
+        if spec['vars'] is None:
+            plot_vars = None
+        else:
+            plot_vars = [dm.df_vars[v] for v in spec['vars']]
+        return dm.plot_par_coor(subset_tuples(dm, spec['subsets']),
+                                plot_vars, progress=progress)
+
+    def cancel_job(job):
+        """Cancel a job of the page (not a batch shared by panels). """
+        if job is not None and job['item'] is None:
+            jobs.cancel(job['id'])
+
+    def submit_job(previous_job, function, *args, batch=False):
+        """Cancel the previous job of a component (superseded) and run
+        "function(job, *args)" in the background (as a batch job, read
+        item by item, with "batch"). Return the job once done, or after
+        JOB_WAIT seconds. """
+        cancel_job(previous_job)
+        if batch:
+            job_id = jobs.submit_batch(function, *args)
+        else:
+            job_id = jobs.submit(function, *args)
+        jobs.wait(job_id, JOB_WAIT)
+        return {'id': job_id, 'item': None}
+
+    def job_result(job):
+        """Result of a job done (tupple (figure, error message) of the
+        panel for a batch). """
+        return jobs.result(job['id'], job['item'])
+
+    def plot_job(job, figure_function, dm, *args):
+        """Job building a figure, reporting the plot steps. """
+        return figure_function(dm, *args, progress=job.progress)
+
+    def plot_job_outputs(job, previous_delta):
+        """Outputs (figure delta, job, polling disabled, progress text)
+        of a plot job : the figure once done, else its progress. """
+        status = jobs.status(job['id'])
+        if status is None or status['state'] == 'cancelled':
+            return (dash.no_update, None, True, "")
+        if status['state'] == 'error':
+            return (dash.no_update, None, True,
+                    "Plot failed : " + status['error'])
+        if status['state'] == 'done':
+            figure = job_result(job)
+            if job['item'] is not None: # plot of a batch
+                (figure, error) = figure
+                if figure is None:
+                    return (dash.no_update, None, True,
+                            "Plot failed : " + error)
+            return (figure_update(figure, previous_delta), None, True, "")
+        return (dash.no_update, job, False, progress_text(status))
+
+    def batch_outputs(batch, job, previous_delta):
+        """Outputs of a plot callback receiving its item of a batch
+        ("Plot all" button) : as "plot_job_outputs", plus the spec. """
+        if batch is None:
+            raise dash.exceptions.PreventUpdate
+        cancel_job(job)
+        job = {'id': batch['id'], 'item': batch['item']}
+        return plot_job_outputs(job, previous_delta) + (batch['spec'],)
+
+    def batch_progress_outputs(job):
+        """Outputs (job, polling disabled, progress text) of the "Plot
+        all" button for a batch job. """
+        status = jobs.status(job['id'])
+        if status is None or status['state'] in ('done', 'cancelled'):
+            return (None, True, "")
+        if status['state'] == 'error':
+            return (None, True, "Plot failed : " + status['error'])
+        return (job, False, "Plot all : " + progress_text(status))
+
+    def batch_plot(dm, graph_type, spec):
+        """Plot of a batch (see DataManager.plot_batch) from its
+        parameters (see "plot_spec"). """
+        subsets = subset_tuples(dm, spec['subsets'])
+        if graph_type == 'scatter':
+            var_z = None
+            if spec['var_z'] is not None:
+                var_z = dm.df_vars[spec['var_z']]
+            return ('scatter', subsets, {'x_var': dm.df_vars[spec['var_x']],
+                                         'y_var': dm.df_vars[spec['var_y']],
+                                         'z_var': var_z,
+                                         'render': spec['render']})
+        plot_vars = None
+        if spec['vars'] is not None:
+            plot_vars = [dm.df_vars[v] for v in spec['vars']]
+        return ('parcoor', subsets, {'varlist': plot_vars})
+
+    def loaded_file_outputs(dm, name, last_modified):
+        """Outputs of the file loading callback once the data is read. """
+        var_options = [{'value' : var_disp, 'label' : var_disp}
+                       for var_disp in dm.df_vars.keys()]
+        op_options = [{'value' : op['disp'], 'label' : op['disp']} 
+                      for op in dm.df_ops]
+        file_desc = '--- File : ' + \
+                    name + \
+                    ' -- ' + \
+                    str(dt.datetime.fromtimestamp(last_modified)) + \
+                    ' ---'
+        display_state = {'display': 'block'}
+        n_scatters = len(dash.callback_context.outputs_list[5])
+        n_parcoors = len(dash.callback_context.outputs_list[8])
+        var_options_scatters = [var_options for i in range(n_scatters)]
+        var_options_parcoors = [var_options for i in range(n_parcoors)]
+        return (file_desc,
+                display_state,
+                display_state,
+                var_options,
+                op_options,
+                var_options_scatters,
+                var_options_scatters,
+                var_options_scatters,
+                var_options_parcoors)
+
+    def invalid_file_outputs():
+        """Outputs of the file loading callback for an invalid file. """
+        file_desc = '--- Invalid file ! ---'
+        display_state = {'display': 'none'}
+        # Wildcard outputs expect one value per matching component
+        n_scatters = len(dash.callback_context.outputs_list[5])
+        n_parcoors = len(dash.callback_context.outputs_list[8])
+        no_update_scatters = [dash.no_update for i in range(n_scatters)]
+        no_update_parcoors = [dash.no_update for i in range(n_parcoors)]
+        return (file_desc,
+                display_state,
+                display_state,
+                dash.no_update,
+                dash.no_update,
+                no_update_scatters,
+                no_update_scatters,
+                no_update_scatters,
+                no_update_parcoors)
+
+    # Load a file (browser upload, or workbook published by the watcher)
     @app.callback(
         [
         Output('ul_txt_2', 'children'),
@@ -292,71 +796,103 @@ def callbacks(app, dm):
         Output({'type': 'var_x_dropdown', 'index': ALL}, 'options'),
         Output({'type': 'var_y_dropdown', 'index': ALL}, 'options'),
         Output({'type': 'var_z_dropdown', 'index': ALL}, 'options'),
-        Output({'type': 'vars_dropdown', 'index': ALL}, 'options')        
+        Output({'type': 'vars_dropdown', 'index': ALL}, 'options'),
+        Output('watch_version', 'data'),
+        Output('dataset_key', 'data'),
+        Output('load_job', 'data'),
+        Output('load_interval', 'disabled')
         ],
         [
-        Input('upload', 'contents')
+        Input('upload', 'contents'),
+        Input('watch_interval', 'n_intervals'),
+        Input('load_interval', 'n_intervals')
         ],
         [
         State('upload', 'filename'),
         State('upload', 'last_modified'),
-        State('graphs_container', 'children')
+        State('watch_version', 'data'),
+        State('graphs_container', 'children'),
+        State('dataset_key', 'data'),
+        State('load_job', 'data')
         ]
     )
     def update_div_excel_disp(contents,
+                              n_intervals,
+                              n_load_intervals,
                               name,
                               last_modified,
-                              graphs):
-        # No action on initialization
-        if contents is None:
+                              watch_version,
+                              graphs,
+                              dataset_key,
+                              job):
+        ctx = dash.callback_context
+        trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
+
+        # Workbook parsed on the server side : no file in the payload,
+        # the page uses the dataset of the watcher
+        if trigger_id == 'watch_interval':
+            (version, name, last_modified, error) = watcher.status
+            if version == watch_version:
+                raise dash.exceptions.PreventUpdate
+            dm = None
+            if error is None:
+                dm = datasets.get(watcher.dm.content_key)
+            if dm is None:
+                return invalid_file_outputs() + \
+                       (version, dash.no_update, dash.no_update, True)
+            return loaded_file_outputs(dm, name, last_modified) + \
+                   (version, dm.content_key, dash.no_update, True)
+
+        if trigger_id == 'load_interval':
+            if job is None:
+                raise dash.exceptions.PreventUpdate
+        else:
+            # No action on initialization
+            if contents is None:
+                raise dash.exceptions.PreventUpdate
+            try:
+                content_type, content_string = contents.split(',')
+                decoded = base64.b64decode(content_string)
+            except Exception as e:
+                print(e)
+                return invalid_file_outputs() + \
+                       (dash.no_update, dash.no_update, None, True)
+            # Parsed in the background (sheets of the previous dataset
+            # of the page are reused); a previous upload is cancelled
+            job = submit_job(job, load_job, datasets,
+                             io.BytesIO(decoded), dataset_key)
+
+        status = jobs.status(job['id'])
+        if status is None or status['state'] == 'cancelled':
             raise dash.exceptions.PreventUpdate
-        try:
-            content_type, content_string = contents.split(',')
-            decoded = base64.b64decode(content_string)
-            file = io.BytesIO(decoded)
-            dm.readxlsx(file)
-            var_options = [{'value' : var_disp, 'label' : var_disp}
-                           for var_disp in dm.df_vars.keys()]
-            op_options = [{'value' : op['disp'], 'label' : op['disp']} 
-                          for op in dm.df_ops]
-            file_desc = '--- File : ' + \
-                        name + \
-                        ' -- ' + \
-                        str(dt.datetime.fromtimestamp(last_modified)) + \
-                        ' ---'
-            display_state = {'display': 'block'}
-            n_scatters = len(dash.callback_context.outputs_list[5])
-            n_parcoors = len(dash.callback_context.outputs_list[8])
-            var_options_scatters = [var_options for i in range(n_scatters)]
-            var_options_parcoors = [var_options for i in range(n_parcoors)]
-            return (file_desc,
-                    display_state,
-                    display_state,
-                    var_options,
-                    op_options,
-                    var_options_scatters,
-                    var_options_scatters,
-                    var_options_scatters,
-                    var_options_parcoors)
-        
-        except Exception as e: 
-            print(e)
-            file_desc = '--- Invalid file ! ---'
-            display_state = {'display': 'none'}
-            return (file_desc,
-                    display_state,
-                    display_state,
-                    dash.no_update,
-                    dash.no_update,
-                    dash.no_update,
-                    dash.no_update,
-                    dash.no_update,
-                    dash.no_update)
+        if status['state'] == 'error':
+            return invalid_file_outputs() + \
+                   (dash.no_update, dash.no_update, None, True)
+        if status['state'] == 'done':
+            dm = datasets.get(job_result(job))
+            if dm is None:
+                return invalid_file_outputs() + \
+                       (dash.no_update, dash.no_update, None, True)
+            return loaded_file_outputs(dm, name, last_modified) + \
+                   (dash.no_update, dm.content_key, None, True)
+        # Still parsing : progress displayed, job polled
+        n_outputs = len(dash.callback_context.outputs_list)
+        outputs = [dash.no_update] * n_outputs
+        for output_i in (5, 6, 7, 8):
+            outputs[output_i] = [dash.no_update] * \
+                len(dash.callback_context.outputs_list[output_i])
+        outputs[0] = '--- Reading ' + str(name) + ' : ' + \
+                     progress_text(status) + ' ---'
+        outputs[-2:] = [job, False]
+        return tuple(outputs)
             
             
-    # Add or remove subsets
+    # Add or remove subsets (definitions kept in the page)
     @app.callback(
+        [
         Output('subsets_container', 'children'),
+        Output('subsets_store', 'data')
+        ],
         [
         Input('add_subset_button', 'n_clicks'),
         Input({'type': 'subset_del_button', 'index': ALL}, 'n_clicks')
@@ -365,11 +901,14 @@ def callbacks(app, dm):
         State('var_dropdown', 'value'),
         State('op_dropdown', 'value'),
         State('crit_input', 'value'),
-        State('subsets_container', 'children')
+        State('subsets_container', 'children'),
+        State('subsets_store', 'data'),
+        State('dataset_key', 'data')
         ]
     )
     def manage_subsets(n_clicks_add, n_clicks_rm,
-                       var_disp, op_disp, crit, current_subsets):
+                       var_disp, op_disp, crit, current_subsets, subsets,
+                       dataset_key):
         
         # Context and init handling (no action)
         ctx = dash.callback_context
@@ -381,25 +920,32 @@ def callbacks(app, dm):
         
         # Creation of a new subset
         if button_id == 'add_subset_button':
+            dm = data_manager(dataset_key)
             var = dm.df_vars[var_disp]
             oper = {o['disp'] : o['op'] for o in dm.df_ops}[op_disp]
+            # Check if not already existing, then if criterion valid
+            if [list(var), op_disp, crit] in [[ss['var'], ss['oper'],
+                                               ss['crit']]
+                                              for ss in subsets.values()]:
+                raise dash.exceptions.PreventUpdate
             if not dm.check_subset(var, oper, crit):
                 raise dash.exceptions.PreventUpdate
-            text = var_disp + " " + op_disp + " " + crit,
+            text = var_disp + " " + op_disp + " " + crit
             subset = {'disp': text,
-                      'var': var,
-                      'oper': oper,
+                      'var': list(var),
+                      'oper': op_disp,
                       'crit': crit}
-            dm.add_subset(n_clicks_add, subset)
             subset_div = def_div_subset(n_clicks_add, text)
-            return current_subsets + [subset_div]
+            return (current_subsets + [subset_div],
+                    dict(subsets, **{str(n_clicks_add): subset}))
         
         # Removal of an existing subset
         else:
             subset_id_to_remove = eval(button_id)['index']
-            dm.remove_subset(subset_id_to_remove)
-            return [ss for ss in current_subsets
-                    if ss['props']['id']['index'] != subset_id_to_remove]
+            return ([ss for ss in current_subsets
+                     if ss['props']['id']['index'] != subset_id_to_remove],
+                    {ss_id: ss for (ss_id, ss) in subsets.items()
+                     if ss_id != str(subset_id_to_remove)})
 
 
     # Add or remove graphs
@@ -411,11 +957,12 @@ def callbacks(app, dm):
         Input({'type': 'graph_del_button', 'index': ALL}, 'n_clicks')
         ],
         [
-        State('graphs_container', 'children')
+        State('graphs_container', 'children'),
+        State('dataset_key', 'data')
         ]
     )
     def manage_graphs(n_clicks_scatter, n_clicks_par_coor, n_clicks_rm,
-                      current_graphs):
+                      current_graphs, dataset_key):
         
         # Context and init handling (no action)
         ctx = dash.callback_context
@@ -436,6 +983,7 @@ def callbacks(app, dm):
             else:
                 n_par_coor = n_clicks_par_coor
             id_index = n_scatter + n_par_coor
+            dm = data_manager(dataset_key)
              # new graph creation
             if button_id == 'add_scatterPlot_button':
                 subset_graph = def_div_scatter_plot(id_index, dm)
@@ -454,12 +1002,12 @@ def callbacks(app, dm):
     # Update subset dropdowns
     @app.callback(
         Output({'type': 'subsets_dropdown', 'index': ALL}, 'options'),
-        [Input('subsets_container', 'children')],
+        [Input('subsets_store', 'data')],
         [State('graphs_container', 'children')]
     )
     def update_subsets_dropdown(subsets, graphs):
         graph_ss_options = []
-        for subset_id, subset in dm.subsets.items():
+        for subset_id, subset in subsets.items():
             dropdown_item = {'value' : subset_id, 'label' : subset['disp']}
             graph_ss_options.append(dropdown_item)
         if not subsets:
@@ -469,75 +1017,226 @@ def callbacks(app, dm):
         return graphs_ss_options
 
 
-    # Plot scatter
+    # Plot scatter, or zoom on it : window decimated again on the server
     @app.callback(
-        Output({'type': 'graph_scatter_div_right', 'index': MATCH},
-               'children'),
+        [
+        Output({'type': 'scatter_delta', 'index': MATCH}, 'data'),
+        Output({'type': 'scatter_job', 'index': MATCH}, 'data'),
+        Output({'type': 'scatter_interval', 'index': MATCH}, 'disabled'),
+        Output({'type': 'scatter_progress', 'index': MATCH}, 'children'),
+        Output({'type': 'scatter_spec', 'index': MATCH}, 'data')
+        ],
         [
         Input({'type': 'graph_plot_scatter_button', 'index': MATCH},
-              'n_clicks')
+              'n_clicks'),
+        Input({'type': 'scatter_graph', 'index': MATCH}, 'relayoutData'),
+        Input({'type': 'scatter_interval', 'index': MATCH}, 'n_intervals'),
+        Input({'type': 'scatter_batch', 'index': MATCH}, 'data')
         ],
         [
         State({'type': 'subsets_dropdown', 'index': MATCH}, 'value'),
         State({'type': 'var_x_dropdown', 'index': MATCH}, 'value'),
         State({'type': 'var_y_dropdown', 'index': MATCH}, 'value'),
-        State({'type': 'var_z_dropdown', 'index': MATCH}, 'value')
+        State({'type': 'var_z_dropdown', 'index': MATCH}, 'value'),
+        State({'type': 'render_dropdown', 'index': MATCH}, 'value'),
+        State({'type': 'scatter_spec', 'index': MATCH}, 'data'),
+        State({'type': 'scatter_delta', 'index': MATCH}, 'data'),
+        State({'type': 'scatter_job', 'index': MATCH}, 'data'),
+        State('subsets_store', 'data'),
+        State('dataset_key', 'data')
         ]
     )  
-    def plot_scatter(n_clicks, subset_ids, var_x_disp, var_y_disp, var_z_disp):
+    def plot_scatter(n_clicks, relayout, n_intervals, batch, subset_ids,
+                     var_x_disp, var_y_disp, var_z_disp, render, spec,
+                     previous_delta, job, subsets, dataset_key):
         ctx = dash.callback_context
         if not ctx.triggered :
             raise dash.exceptions.PreventUpdate
-        button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-        if button_id == "":
+        trigger = ctx.triggered[0]['prop_id']
+        if trigger.endswith('.n_intervals'):
+            if job is None:
+                raise dash.exceptions.PreventUpdate
+            return plot_job_outputs(job, previous_delta) + \
+                   (dash.no_update,)
+        if trigger.endswith('.data'):
+            return batch_outputs(batch, job, previous_delta)
+        if trigger.endswith('.relayoutData'):
+            if relayout is None or spec is None:
+                raise dash.exceptions.PreventUpdate
+            ranges = relayout_ranges(relayout)
+            if ranges is None:
+                raise dash.exceptions.PreventUpdate
+            (x_range, y_range) = ranges
+            dm = data_manager(spec['dataset'])
+            job = submit_job(job, plot_job, scatter_figure, dm, spec,
+                             x_range, y_range)
+            return plot_job_outputs(job, previous_delta) + \
+                   (dash.no_update,)
+        if trigger.split('.')[0] == "":
             raise dash.exceptions.PreventUpdate
-        if subset_ids is None :
-            subsets = []
-        else:
-            subsets = [dm.subsets[ss_id] for ss_id in subset_ids]
-        subsets_tups = [(ss['var'], ss['oper'], ss['crit']) for ss in subsets]
-        var_x = dm.df_vars[var_x_disp]
-        var_y = dm.df_vars[var_y_disp]
-        if var_z_disp is None:
-            var_z = None
-        else:
-            var_z = dm.df_vars[var_z_disp]
-        return dcc.Graph(figure = dm.plot_scatter(subsets_tups,
-                                                  var_x,
-                                                  var_y,
-                                                  var_z))
+        spec = plot_spec(dataset_key, subsets, subset_ids,
+                         var_x=var_x_disp,
+                         var_y=var_y_disp,
+                         var_z=var_z_disp,
+                         render=render)
+        dm = data_manager(dataset_key)
+        job = submit_job(job, plot_job, scatter_figure, dm, spec)
+        return plot_job_outputs(job, previous_delta) + (spec,)
 
 
     # Plot parcoor
     @app.callback(
-        Output({'type': 'graph_parcoor_scatter_div_right', 'index': MATCH},
-               'children'),
+        [
+        Output({'type': 'parcoor_delta', 'index': MATCH}, 'data'),
+        Output({'type': 'parcoor_job', 'index': MATCH}, 'data'),
+        Output({'type': 'parcoor_interval', 'index': MATCH}, 'disabled'),
+        Output({'type': 'parcoor_progress', 'index': MATCH}, 'children'),
+        Output({'type': 'parcoor_spec', 'index': MATCH}, 'data')
+        ],
         [
         Input({'type': 'graph_plot_parcoor_button', 'index': MATCH},
-              'n_clicks')
+              'n_clicks'),
+        Input({'type': 'parcoor_interval', 'index': MATCH}, 'n_intervals'),
+        Input({'type': 'parcoor_batch', 'index': MATCH}, 'data')
         ],
         [
         State({'type': 'subsets_dropdown', 'index': MATCH}, 'value'),
-        State({'type': 'vars_dropdown', 'index': MATCH}, 'value')
+        State({'type': 'vars_dropdown', 'index': MATCH}, 'value'),
+        State({'type': 'parcoor_delta', 'index': MATCH}, 'data'),
+        State({'type': 'parcoor_job', 'index': MATCH}, 'data'),
+        State('subsets_store', 'data'),
+        State('dataset_key', 'data')
         ]
     )  
-    def plot_parcoor(n_clicks, subset_ids, plot_vars_disp):
+    def plot_parcoor(n_clicks, n_intervals, batch, subset_ids, plot_vars_disp,
+                     previous_delta, job, subsets, dataset_key):
         ctx = dash.callback_context
         if not ctx.triggered :
             raise dash.exceptions.PreventUpdate
-        button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-        if button_id == "":
+        trigger = ctx.triggered[0]['prop_id']
+        if trigger.endswith('.n_intervals'):
+            if job is None:
+                raise dash.exceptions.PreventUpdate
+            return plot_job_outputs(job, previous_delta) + \
+                   (dash.no_update,)
+        if trigger.endswith('.data'):
+            return batch_outputs(batch, job, previous_delta)
+        if trigger.split('.')[0] == "":
             raise dash.exceptions.PreventUpdate
-        if subset_ids is None :
-            subsets = []
-        else:
-            subsets = [dm.subsets[ss_id] for ss_id in subset_ids]
-        subsets_tups = [(ss['var'], ss['oper'], ss['crit']) for ss in subsets]
-        if plot_vars_disp is None:
-            plot_vars = None
-        else:
-            plot_vars = [dm.df_vars[v] for v in plot_vars_disp]
-        return dcc.Graph(figure = dm.plot_par_coor(subsets_tups, plot_vars))
+        spec = plot_spec(dataset_key, subsets, subset_ids,
+                         vars=plot_vars_disp)
+        dm = data_manager(dataset_key)
+        job = submit_job(job, plot_job, parcoor_figure, dm, spec)
+        return plot_job_outputs(job, previous_delta) + (spec,)
+
+
+    # Plot all the graphs in one pass : the figures are built by a
+    # single job (shared subsets and columns resolved once), each panel
+    # receiving its item of the batch. The progress of the batch is
+    # polled and displayed under the button
+    @app.callback(
+        [
+        Output({'type': 'scatter_batch', 'index': ALL}, 'data'),
+        Output({'type': 'parcoor_batch', 'index': ALL}, 'data'),
+        Output('plot_all_job', 'data'),
+        Output('plot_all_interval', 'disabled'),
+        Output('plot_all_progress', 'children')
+        ],
+        [
+        Input('plot_all_button', 'n_clicks'),
+        Input('plot_all_interval', 'n_intervals')
+        ],
+        [
+        State({'type': 'subsets_dropdown', 'index': ALL}, 'value'),
+        State({'type': 'var_x_dropdown', 'index': ALL}, 'value'),
+        State({'type': 'var_y_dropdown', 'index': ALL}, 'value'),
+        State({'type': 'var_z_dropdown', 'index': ALL}, 'value'),
+        State({'type': 'render_dropdown', 'index': ALL}, 'value'),
+        State({'type': 'vars_dropdown', 'index': ALL}, 'value'),
+        State('subsets_store', 'data'),
+        State('dataset_key', 'data'),
+        State('plot_all_job', 'data')
+        ]
+    )
+    def plot_all(n_clicks, n_intervals, subset_ids, vars_x_disp, vars_y_disp,
+                 vars_z_disp, renders, plot_vars_disp, subsets, dataset_key,
+                 previous_job):
+        ctx = dash.callback_context
+        if not ctx.triggered or n_clicks is None:
+            raise dash.exceptions.PreventUpdate
+        trigger = ctx.triggered[0]['prop_id']
+        if trigger.endswith('.n_intervals'):
+            if previous_job is None:
+                raise dash.exceptions.PreventUpdate
+            no_update_panels = tuple([dash.no_update] * len(outputs)
+                                     for outputs in ctx.outputs_list[:2])
+            return no_update_panels + batch_progress_outputs(previous_job)
+        dm = data_manager(dataset_key)
+        # Values of the dropdowns by panel index
+        (subset_ids, vars_x_disp, vars_y_disp, vars_z_disp, renders,
+         plot_vars_disp) = [
+            {state['id']['index']: value
+             for (state, value) in zip(states, values)}
+            for (states, values) in zip(ctx.states_list,
+                                        (subset_ids, vars_x_disp,
+                                         vars_y_disp, vars_z_disp,
+                                         renders, plot_vars_disp))]
+
+        # Specs of the panels which can be plotted
+        specs = {}
+        for (id_index, var_x_disp) in vars_x_disp.items():
+            if var_x_disp is None or vars_y_disp[id_index] is None:
+                continue
+            specs[('scatter', id_index)] = plot_spec(
+                dataset_key, subsets, subset_ids.get(id_index),
+                var_x=var_x_disp,
+                var_y=vars_y_disp[id_index],
+                var_z=vars_z_disp[id_index],
+                render=renders[id_index])
+        for (id_index, vars_disp) in plot_vars_disp.items():
+            specs[('parcoor', id_index)] = plot_spec(
+                dataset_key, subsets, subset_ids.get(id_index),
+                vars=vars_disp)
+        if not specs:
+            raise dash.exceptions.PreventUpdate
+        panels = list(specs)
+        plots = [batch_plot(dm, graph_type, specs[(graph_type, id_index)])
+                 for (graph_type, id_index) in panels]
+        job = submit_job(previous_job, batch_job, dm, plots, batch=True)
+
+        # Batch item (job, position of the figure, spec) of each panel
+        outputs = []
+        for (graph_type, output_i) in (('scatter', 0), ('parcoor', 1)):
+            items = []
+            for output in ctx.outputs_list[output_i]:
+                panel = (graph_type, output['id']['index'])
+                if panel in specs:
+                    items.append({'id': job['id'],
+                                  'item': panels.index(panel),
+                                  'spec': specs[panel]})
+                else:
+                    items.append(dash.no_update)
+            outputs.append(items)
+        return tuple(outputs) + batch_progress_outputs(job)
+
+
+    # Changes of the figures applied in the browser
+    for graph_type in ('scatter', 'parcoor'):
+        app.clientside_callback(
+            APPLY_FIGURE_DELTA,
+            [
+            Output({'type': graph_type + '_graph', 'index': MATCH},
+                   'figure'),
+            Output({'type': graph_type + '_graph', 'index': MATCH},
+                   'style')
+            ],
+            [
+            Input({'type': graph_type + '_delta', 'index': MATCH}, 'data')
+            ],
+            [
+            State({'type': graph_type + '_graph', 'index': MATCH}, 'figure')
+            ]
+        )
 
 
 def main():
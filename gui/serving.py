@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import gc
+import os
+import signal
+import socket
+
+from werkzeug.serving import make_server
+
+
+def run(app, host='0.0.0.0', port=8080, workers=1, parent_task=None):
+    """Serve a Dash application.
+
+    With several "workers" (Unix only), the listening socket is opened
+    once and shared by forked worker processes, each one serving the
+    requests with threads. The application must be built before : the
+    workers share its memory (copy on write), and the datasets are
+    shared through the memory-mapped workbook cache.
+
+    Parameters
+    ----------
+    app : Dash application
+        Application to serve.
+    host : string
+        Listening address. The default is all interfaces.
+    port : int
+        Listening port. The default is 8080.
+    workers : int
+        Number of worker processes. The default is 1 (single process).
+    parent_task : callable
+        Function without argument called in the parent process once the
+        workers are started (e.g. start of the folder watcher), or
+        before serving with a single process. The default is None.
+    """
+    if workers > 1 and not hasattr(os, 'fork'):
+        print("Several workers are not supported on this system : "
+              "single process")
+        workers = 1
+    if workers <= 1:
+        if parent_task is not None:
+            parent_task()
+        app.run_server(debug=False, port=port, host=host)
+        return
+
+    # Objects of the parent kept out of the garbage collector : their
+    # pages are not copied in each worker by the collections
+    gc.freeze()
+    listener = socket.create_server((host, port), backlog=128)
+    listener.set_inheritable(True)
+    children = []
+    for worker_i in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Worker : serves until terminated
+            try:
+                server = make_server(host, port, app.server, threaded=True,
+                                     fd=listener.fileno())
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    listener.close()
+    print("Serving on {0}:{1} with {2} workers".format(host, port, workers))
+
+    # Parent : tasks started after the fork (threads are not copied)
+    if parent_task is not None:
+        parent_task()
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass